@@ -1,10 +1,15 @@
 import pdfplumber
 import csv
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
 
 path = "../material/Suomen kirjailijat 1917-1944.pdf"
 pages = "13-574"
 skip_pages = "273-306, 387-394"
 page_limit = -1
+workers = 0  # Worker processes for page parsing, 0 = one per CPU core
 
 def parse_skip_pages(skip_pages_str):
     """Parse skip_pages string into a list of page ranges to skip"""
@@ -23,32 +28,27 @@ def parse_skip_pages(skip_pages_str):
     
     return skip_ranges
 
-def is_page_skipped(page_num, skip_ranges):
-    """Check if a page should be skipped"""
-    for start, end in skip_ranges:
-        if start <= page_num <= end:
-            return True
-    return False
-
 def load_exclusion_patterns():
-    """Load patterns from 01_not_header.txt that should not be treated as headers"""
+    """Load patterns from 01_not_header.txt that should not be treated as headers.
+    Returned as a tuple so str.startswith can test all prefixes in one call."""
     try:
         with open("01_not_header.txt", 'r', encoding='utf-8') as f:
-            patterns = [line.strip() for line in f.readlines() if line.strip()]
+            patterns = tuple(line.strip() for line in f.readlines() if line.strip())
         return patterns
     except FileNotFoundError:
         print("Warning: 01_not_header.txt not found. No exclusion patterns will be applied.")
-        return []
+        return ()
 
 def load_inclusion_patterns():
-    """Load patterns from 01_is_header.txt that should be treated as headers"""
+    """Load patterns from 01_is_header.txt that should be treated as headers.
+    Returned as a frozenset since lines are matched exactly."""
     try:
         with open("01_is_header.txt", 'r', encoding='utf-8') as f:
-            patterns = [line.strip() for line in f.readlines() if line.strip()]
+            patterns = frozenset(line.strip() for line in f.readlines() if line.strip())
         return patterns
     except FileNotFoundError:
         print("Warning: 01_is_header.txt not found. No inclusion patterns will be applied.")
-        return []
+        return frozenset()
 
 def load_replacement_map():
     """Load replacement mappings from 01_replace.csv"""
@@ -69,8 +69,10 @@ def load_replacement_map():
         return {}
 
 def extract_pdf_text(pdf_path, pages_range, page_limit, skip_pages_str):
-    # Load replacement map early
+    # Load replacement map and header patterns once for the whole run
     replacement_map = load_replacement_map()
+    exclusion_patterns = load_exclusion_patterns()
+    inclusion_patterns = load_inclusion_patterns()
     
     # Parse the pages range
     start_page, end_page = map(int, pages_range.split('-'))
@@ -79,117 +81,144 @@ def extract_pdf_text(pdf_path, pages_range, page_limit, skip_pages_str):
     if page_limit > 0:
         end_page = min(start_page + page_limit - 1, end_page)
     
-    # Parse skip pages
+    # Parse skip pages into a set of page numbers for quick lookup
     skip_ranges = parse_skip_pages(skip_pages_str)
+    skipped_pages = set()
+    for start, end in skip_ranges:
+        skipped_pages.update(range(start, end + 1))
     
-    # Open the PDF file
+    # Collect the pages to process
     with pdfplumber.open(pdf_path) as pdf:
         pdf_total_pages = len(pdf.pages)
         
-        debug_output = ""
-        clean_output = ""
-        
         # Track continuous page numbering for HTML comments
         # This counts only the processed pages, skipping "extra" unnumbered pages
+        tasks = []
         continuous_page_num = start_page
-        
-        # Extract text from specified pages
-        for page_num in range(start_page - 1, min(end_page, pdf_total_pages)):
-            actual_page_num = page_num + 1  # Convert to 1-based numbering
+        for page_index in range(start_page - 1, min(end_page, pdf_total_pages)):
+            actual_page_num = page_index + 1  # Convert to 1-based numbering
             
             # Skip this page if it's in the skip list (extra pages without numbers)
-            if is_page_skipped(actual_page_num, skip_ranges):
+            if actual_page_num in skipped_pages:
                 print(f"Skipping extra page {actual_page_num} (no page number)...")
                 continue
             
-            print(f"Processing page {actual_page_num} (numbered as {continuous_page_num})...")
-            page = pdf.pages[page_num]
-            
-            # Get page dimensions
-            page_width = page.width
-            page_height = page.height
-            
-            # Define layout zones
-            header_height = page_height * 0.047  # Top 4.7% is header
-            
-            # Process text by layout zones using continuous page numbering
-            # (skipping unnumbered extra pages)
-            debug_text, clean_text = process_page_layout(page, page_width, page_height, header_height, continuous_page_num, replacement_map)
-            debug_output += debug_text
-            clean_output += clean_text
-            
-            # Increment continuous page number only for processed pages
+            tasks.append((page_index, continuous_page_num))
             continuous_page_num += 1
         
-        # Write debug output
-        with open("01_output_debug.txt", 'w', encoding='utf-8') as f:
-            f.write(debug_output)
-        
-        # Write clean output
-        with open("01_output.md", 'w', encoding='utf-8') as f:
-            f.write(clean_output)
-        
-        print("Debug output saved to 01_output_debug.txt")
-        print("Clean output saved to 01_output.md")
+        # The scanned pages normally all have the same size, so the layout zones
+        # are computed once here. Otherwise each page computes its own.
+        page_sizes = {(pdf.pages[page_index].width, pdf.pages[page_index].height) for page_index, _ in tasks}
+    page_layout = get_page_layout(*page_sizes.pop()) if len(page_sizes) == 1 else None
+    
+    # Pages are independent, so parse them in parallel worker processes.
+    # executor.map returns the results in page order, and each page is written
+    # to the debug and clean outputs as soon as it is done.
+    max_workers = _get_max_workers(len(tasks))
+    print(f"Processing {len(tasks)} pages with {max_workers} worker processes...")
+    with open("01_output_debug.txt", 'w', encoding='utf-8', buffering=1 << 20) as debug_file, \
+         open("01_output.md", 'w', encoding='utf-8', buffering=1 << 20) as clean_file, \
+         ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(pdf_path, page_layout, replacement_map, inclusion_patterns, exclusion_patterns)) as executor:
+        for (page_index, page_num), (debug_text, clean_text) in zip(tasks, executor.map(_process_one_page, tasks)):
+            print(f"Processed page {page_index + 1} (numbered as {page_num})")
+            debug_file.write(debug_text)
+            clean_file.write(clean_text)
+    
+    print("Debug output saved to 01_output_debug.txt")
+    print("Clean output saved to 01_output.md")
+
+def _get_max_workers(page_count):
+    """Number of worker processes: the configured workers, or one per CPU core, but never more than there are pages"""
+    count = workers if workers > 0 else (os.cpu_count() or 1)
+    return max(1, min(count, page_count))
+
+# State for each worker process, set up by _init_worker
+_worker_state = {}
+
+def _init_worker(pdf_path, page_layout, replacement_map, inclusion_patterns, exclusion_patterns):
+    """Open the PDF once per worker process and keep the page layout and text patterns for all its pages"""
+    _worker_state['pdf'] = pdfplumber.open(pdf_path)
+    _worker_state['layout'] = page_layout
+    _worker_state['patterns'] = (replacement_map, inclusion_patterns, exclusion_patterns)
 
-def process_page_layout(page, page_width, page_height, header_height, page_num, replacement_map):
+def _process_one_page(task):
+    """Process one (page_index, page_num) task in a worker process, returns (debug_text, clean_text)"""
+    page_index, page_num = task
+    page = _worker_state['pdf'].pages[page_index]
+    
+    # Use the shared layout zones, or compute them for a page of a different size
+    header_height, mid_x = _worker_state['layout'] or get_page_layout(page.width, page.height)
+    
+    # Process text by layout zones using continuous page numbering
+    # (skipping unnumbered extra pages)
+    result = process_page_layout(page, header_height, mid_x, page_num, *_worker_state['patterns'])
+    
+    # Free the parsed page objects, each worker goes through many pages
+    page.close()
+    return result
+
+def get_page_layout(page_width, page_height):
+    """Layout zones of a page, returns (header_height, mid_x)"""
+    header_height = page_height * 0.047  # Top 4.7% is header
+    mid_x = page_width / 2  # Left and right column split
+    return header_height, mid_x
+
+def process_page_layout(page, header_height, mid_x, page_num, replacement_map, inclusion_patterns, exclusion_patterns):
     # Extract all text objects with their positions
     words = page.extract_words()
     
-    # Separate header and content
-    header_words = [w for w in words if w['top'] < header_height]
-    content_words = [w for w in words if w['top'] >= header_height]
+    # Separate header and the two content columns in a single pass over the words
+    header_words = []
+    left_column = []
+    right_column = []
+    for w in words:
+        if w['top'] < header_height:
+            header_words.append(w)
+        elif w['x0'] < mid_x:
+            left_column.append(w)
+        else:
+            right_column.append(w)
     
-    debug_result = ""
-    clean_result = ""
+    debug_parts = []
+    clean_parts = []
     
     # Process header
     if header_words:
-        header_text = " ".join([w['text'] for w in sorted(header_words, key=lambda x: x['x0'])])
-        debug_result += "HEADER:\n"
-        debug_result += header_text + "\n\n"
-        clean_result += f"<!-- Page {page_num}: {header_text} -->\n\n"
+        header_text = " ".join([w['text'] for w in sorted(header_words, key=itemgetter('x0'))])
+        debug_parts.append("HEADER:\n")
+        debug_parts.append(header_text + "\n\n")
+        clean_parts.append(f"<!-- Page {page_num}: {header_text} -->\n\n")
     
     # Process content in two columns
-    if content_words:
-        # Split into left and right columns
-        mid_x = page_width / 2
-        left_column = [w for w in content_words if w['x0'] < mid_x]
-        right_column = [w for w in content_words if w['x0'] >= mid_x]
-        
+    if left_column or right_column:
         # Sort each column by top position, then by left position
-        left_column.sort(key=lambda x: (x['top'], x['x0']))
-        right_column.sort(key=lambda x: (x['top'], x['x0']))
+        left_column.sort(key=itemgetter('top', 'x0'))
+        right_column.sort(key=itemgetter('top', 'x0'))
         
         # Process columns
-        left_debug, left_clean = process_column(left_column, replacement_map)
-        right_debug, right_clean = process_column(right_column, replacement_map)
+        left_debug, left_clean = process_column(left_column, replacement_map, inclusion_patterns, exclusion_patterns)
+        right_debug, right_clean = process_column(right_column, replacement_map, inclusion_patterns, exclusion_patterns)
         
         # Add column content
         if left_debug.strip():
-            debug_result += "LEFT COLUMN:\n"
-            debug_result += left_debug + "\n"
-            clean_result += left_clean + "\n"
+            debug_parts.append("LEFT COLUMN:\n")
+            debug_parts.append(left_debug + "\n")
+            clean_parts.append(left_clean + "\n")
         if right_debug.strip():
-            debug_result += "RIGHT COLUMN:\n"
-            debug_result += right_debug + "\n"
-            clean_result += right_clean + "\n"
+            debug_parts.append("RIGHT COLUMN:\n")
+            debug_parts.append(right_debug + "\n")
+            clean_parts.append(right_clean + "\n")
     
-    return debug_result, clean_result
+    return "".join(debug_parts), "".join(clean_parts)
 
 def is_excluded_header(line_text, exclusion_patterns):
     """Check if a line should be excluded from being treated as a header"""
-    for pattern in exclusion_patterns:
-        if line_text.startswith(pattern):
-            return True
-    return False
+    return line_text.startswith(exclusion_patterns)
 
 def is_included_header(line_text, inclusion_patterns):
     """Check if a line should be treated as a header based on inclusion patterns"""
-    for pattern in inclusion_patterns:
-        if line_text == pattern:
-            return True
-    return False
+    return line_text in inclusion_patterns
 
 def is_probable_header(text):
     """
@@ -202,39 +231,83 @@ def is_probable_header(text):
     if not text:
         return False
     
-    # First character is uppercase
-    if text[0].isupper():
+    # First character is uppercase (by far the most common case)
+    first = text[0]
+    if first.isupper():
         return True
     
-    # Check for lowercase + apostrophe + capital pattern (e.g., "d’Ornot")
-    if len(text) >= 3:
-        if text[0].islower() and text[1] == "’" and text[2].isupper():
-            return True
-    
-    # Check for "de " followed by capital letter (e.g., "de Vries")
-    if text.startswith("de ") and len(text) >= 4:
-        if text[3].isupper():
-            return True
+    # Check for lowercase + apostrophe (U+2019) + capital pattern (e.g., "d’Ornot")
+    if len(text) >= 3 and first.islower() and text[1] == "\u2019" and text[2].isupper():
+        return True
     
-    # Check for "van " followed by capital letter (e.g., "van Gogh")
-    if text.startswith("van ") and len(text) >= 5:
-        if text[4].isupper():
-            return True
+    # Check for "de " or "van " followed by capital letter (e.g., "de Vries", "van Gogh")
+    if text.startswith(("de ", "van ")):
+        name_start = 3 if first == "d" else 4
+        return len(text) > name_start and text[name_start].isupper()
     
     return False
 
-def process_column(column_words, replacement_map):
-    if not column_words:
-        return "", ""
+@functools.lru_cache(maxsize=8192)
+def _classify_header(line_text, is_tall, is_spaced, inclusion_patterns, exclusion_patterns):
+    """
+    Decide whether a line is a header. is_tall and is_spaced are the outcomes of the
+    height and distance thresholds, see _emit_line. Taking the outcomes instead of the
+    raw measurements keeps the decision exact while letting running heads and short
+    stub lines that repeat on many pages hit the cache.
+    """
+    # First check if line matches inclusion patterns
+    if is_included_header(line_text, inclusion_patterns):
+        return True
+    # A line is a header if it has large height, sufficient distance, contains no numbers, starts with capital letter, is not excluded, and is longer than 1 character
+    return (is_tall and is_spaced and 
+            not any(map(str.isdigit, line_text)) and 
+            is_probable_header(line_text) and
+            len(line_text.strip()) > 1 and
+            not is_excluded_header(line_text, exclusion_patterns))
+
+def _emit_line(line_words, distance, replacement_map, inclusion_patterns, exclusion_patterns):
+    """
+    Format one line of a column for the debug and clean outputs.
+    distance is the vertical distance to the previous line, or None for the first line.
+    Returns a (debug_text, clean_text) tuple.
+    """
+    # Sort words within the line by horizontal position
+    line_words.sort(key=itemgetter('x0'))
+    line_text = " ".join([w['text'] for w in line_words])
     
-    # Load exclusion patterns
-    exclusion_patterns = load_exclusion_patterns()
+    # Apply replacement if the line exists in replacement_map
+    if line_text in replacement_map:
+        line_text = replacement_map[line_text]
+    # Average word height, summed in x0 order so that the float sum (and the header
+    # threshold below) doesn't depend on the order pdfplumber returned the words in
+    avg_height = sum(w.get('height', 0) for w in line_words) / len(line_words)
+    first_word_x = line_words[0]['x0']
     
-    # Load inclusion patterns
-    inclusion_patterns = load_inclusion_patterns()
+    if distance is None:
+        spacing = ""
+        distance_text = "N/A"
+    else:
+        # Add empty row if distance >= 12.5
+        spacing = "\n" if distance >= 12.5 else ""
+        distance_text = f"{distance:.1f}px"
+    
+    # Headers are set in a larger font (average word height above 8.5px) and, except at the top of a column,
+    # with a gap of more than 24px to the previous line
+    is_tall = avg_height > 8.5
+    is_spaced = distance is None or distance > 24
+    if _classify_header(line_text, is_tall, is_spaced, inclusion_patterns, exclusion_patterns):
+        line_text = f"## {line_text}"
     
-    debug_result = ""
-    clean_result = ""
+    debug_text = f"{spacing}[height: {avg_height:.1f}px, distance: {distance_text}, x: {first_word_x:.1f}px] {line_text}\n"
+    clean_text = f"{spacing}{line_text}\n"
+    return debug_text, clean_text
+
+def process_column(column_words, replacement_map, inclusion_patterns, exclusion_patterns):
+    if not column_words:
+        return "", ""
+    
+    debug_parts = []
+    clean_parts = []
     current_line = []
     current_line_height = None
     previous_line_height = None
@@ -246,58 +319,11 @@ def process_column(column_words, replacement_map):
         if current_line_height and abs(line_height - current_line_height) > 5:
             # Process the current line
             if current_line:
-                # Sort words within the line by horizontal position
-                current_line.sort(key=lambda x: x['x0'])
-                line_text = " ".join([w['text'] for w in current_line])
-                
-                # Apply replacement if the line exists in replacement_map
-                if line_text in replacement_map:
-                    line_text = replacement_map[line_text]
-                avg_height = sum(w.get('height', 0) for w in current_line) / len(current_line)
-                first_word_x = current_line[0]['x0'] if current_line else 0
-                
                 # Calculate distance from previous row
-                if previous_line_height is not None:
-                    distance = current_line_height - previous_line_height
-                    # Add empty row if distance >= 12.5
-                    if distance >= 12.5:
-                        debug_result += "\n"
-                        clean_result += "\n"
-                    
-                    # Check if this is a header
-                    # First check if line matches inclusion patterns
-                    if is_included_header(line_text, inclusion_patterns):
-                        is_header = True
-                    else:
-                        # A line is a header if it has large height, sufficient distance, contains no numbers, starts with capital letter, is not excluded, and is longer than 1 character
-                        is_header = (avg_height > 8.5 and distance > 24 and 
-                                   not any(char.isdigit() for char in line_text) and 
-                                   is_probable_header(line_text) and
-                                   len(line_text.strip()) > 1 and
-                                   not is_excluded_header(line_text, exclusion_patterns))
-                    if is_header:
-                        debug_result += f"[height: {avg_height:.1f}px, distance: {distance:.1f}px, x: {first_word_x:.1f}px] ## {line_text}\n"
-                        clean_result += f"## {line_text}\n"
-                    else:
-                        debug_result += f"[height: {avg_height:.1f}px, distance: {distance:.1f}px, x: {first_word_x:.1f}px] {line_text}\n"
-                        clean_result += f"{line_text}\n"
-                else:
-                    # First row - check if header based on height only, no numbers, starts with capital letter, is not excluded, and is longer than 1 character
-                    # First check if line matches inclusion patterns
-                    if is_included_header(line_text, inclusion_patterns):
-                        is_header = True
-                    else:
-                        is_header = (avg_height > 8.5 and 
-                                   not any(char.isdigit() for char in line_text) and 
-                                   is_probable_header(line_text) and
-                                   len(line_text.strip()) > 1 and
-                                   not is_excluded_header(line_text, exclusion_patterns))
-                    if is_header:
-                        debug_result += f"[height: {avg_height:.1f}px, distance: N/A, x: {first_word_x:.1f}px] ## {line_text}\n"
-                        clean_result += f"## {line_text}\n"
-                    else:
-                        debug_result += f"[height: {avg_height:.1f}px, distance: N/A, x: {first_word_x:.1f}px] {line_text}\n"
-                        clean_result += f"{line_text}\n"
+                distance = current_line_height - previous_line_height if previous_line_height is not None else None
+                debug_text, clean_text = _emit_line(current_line, distance, replacement_map, inclusion_patterns, exclusion_patterns)
+                debug_parts.append(debug_text)
+                clean_parts.append(clean_text)
                 
                 previous_line_height = current_line_height
             
@@ -311,60 +337,12 @@ def process_column(column_words, replacement_map):
     
     # Process the last line
     if current_line:
-        # Sort words within the line by horizontal position
-        current_line.sort(key=lambda x: x['x0'])
-        line_text = " ".join([w['text'] for w in current_line])
-        
-        # Apply replacement if the line exists in replacement_map
-        if line_text in replacement_map:
-            line_text = replacement_map[line_text]
-        
-        avg_height = sum(w.get('height', 0) for w in current_line) / len(current_line)
-        first_word_x = current_line[0]['x0'] if current_line else 0
-        
-        if previous_line_height is not None:
-            distance = current_line_height - previous_line_height
-            # Add empty row if distance >= 12.5
-            if distance >= 12.5:
-                debug_result += "\n"
-                clean_result += "\n"
-            
-            # Check if this is a header
-            # First check if line matches inclusion patterns
-            if is_included_header(line_text, inclusion_patterns):
-                is_header = True
-            else:
-                # A line is a header if it has large height, sufficient distance, contains no numbers, starts with capital letter, is not excluded, and is longer than 1 character
-                is_header = (avg_height > 8.5 and distance > 24 and 
-                           not any(char.isdigit() for char in line_text) and 
-                           is_probable_header(line_text) and
-                           len(line_text.strip()) > 1 and
-                           not is_excluded_header(line_text, exclusion_patterns))
-            if is_header:
-                debug_result += f"[height: {avg_height:.1f}px, distance: {distance:.1f}px, x: {first_word_x:.1f}px] ## {line_text}\n"
-                clean_result += f"## {line_text}\n"
-            else:
-                debug_result += f"[height: {avg_height:.1f}px, distance: {distance:.1f}px, x: {first_word_x:.1f}px] {line_text}\n"
-                clean_result += f"{line_text}\n"
-        else:
-            # First row - check if header based on height only, no numbers, starts with capital letter, is not excluded, and is longer than 1 character
-            # First check if line matches inclusion patterns
-            if is_included_header(line_text, inclusion_patterns):
-                is_header = True
-            else:
-                is_header = (avg_height > 8.5 and 
-                           not any(char.isdigit() for char in line_text) and 
-                           is_probable_header(line_text) and
-                           len(line_text.strip()) > 1 and
-                           not is_excluded_header(line_text, exclusion_patterns))
-            if is_header:
-                debug_result += f"[height: {avg_height:.1f}px, distance: N/A, x: {first_word_x:.1f}px] ## {line_text}\n"
-                clean_result += f"## {line_text}\n"
-            else:
-                debug_result += f"[height: {avg_height:.1f}px, distance: N/A, x: {first_word_x:.1f}px] {line_text}\n"
-                clean_result += f"{line_text}\n"
+        distance = current_line_height - previous_line_height if previous_line_height is not None else None
+        debug_text, clean_text = _emit_line(current_line, distance, replacement_map, inclusion_patterns, exclusion_patterns)
+        debug_parts.append(debug_text)
+        clean_parts.append(clean_text)
     
-    return debug_result, clean_result
+    return "".join(debug_parts), "".join(clean_parts)
 
 def main():
     extract_pdf_text(path, pages, page_limit, skip_pages)
@@ -1,6 +1,13 @@
 import csv
 import re
 
+# Page comments written by 01_pdf2md.py, e.g. <!-- Page 13: Aaltonen 13 -->
+PAGE_COMMENT_RE = re.compile(r'<!-- Page (\d+):')
+# Date of birth at the start of an entry's first line, e.g. 29.3.1898 (dd.mm.yyyy)
+DOB_RE = re.compile(r'(\d{1,2}\.\d{1,2}\.\d{4})')
+
+CSV_FIELDNAMES = ['name', 'aka', 'page_start', 'page_end', 'row_count', 'chars_count', 'ks.', 'firstlast', 'dob']
+
 def load_replacements(replace_file="02_replace.csv"):
     """
     Load replacement rules from CSV file.
@@ -28,6 +35,54 @@ def load_replacements(replace_file="02_replace.csv"):
     
     return replacements
 
+def to_firstlast(name):
+    """Turn "Last, First" into "First Last" by splitting on the comma. Names without a comma are kept as is."""
+    name_parts = name.split(',')
+    if len(name_parts) >= 2:
+        return f"{name_parts[1].strip()} {name_parts[0].strip()}"
+    return name
+
+def read_entries(input_file):
+    """
+    Read the markdown file line by line and yield one entry per header.
+    Only the current entry is kept in memory, not the whole file.
+    
+    Args:
+        input_file (str): Path to the input markdown file
+    
+    Yields:
+        tuple: (header_line, page_start, page_end, body_lines) where body_lines are the
+               stripped lines up to the next header, page_start comes from the last HTML
+               page comment before the header and page_end from the last one before the
+               next header (None if there is none)
+    """
+    header_line = None
+    page_num = None
+    body_lines = []
+    current_page = None
+    
+    with open(input_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            
+            # Check if this is a header (starts with ##)
+            if line.startswith('##'):
+                if header_line is not None:
+                    yield header_line, page_num, current_page, body_lines
+                header_line = line
+                page_num = current_page
+                body_lines = []
+            elif header_line is not None:
+                body_lines.append(line)
+            
+            # Keep track of the page we are on
+            comment_match = PAGE_COMMENT_RE.search(line)
+            if comment_match:
+                current_page = int(comment_match.group(1))
+    
+    if header_line is not None:
+        yield header_line, page_num, current_page, body_lines
+
 def parse_markdown_to_csv(input_file="01_output.md", output_file="02_output.csv"):
     """
     Parse the markdown file to extract headers and their associated content.
@@ -36,165 +91,94 @@ def parse_markdown_to_csv(input_file="01_output.md", output_file="02_output.csv"
         input_file (str): Path to the input markdown file
         output_file (str): Path to the output CSV file
     """
-    csv_data = []
-    
     # Load replacement rules
     replacements = load_replacements()
     
-    with open(input_file, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # Split content into lines
-    lines = content.split('\n')
+    entry_count = 0
+    rows_without_ks = 0
+    first_entry = None
     
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # Check if this is a header (starts with ##)
-        if line.startswith('##'):
+    # Write each entry to the CSV file as soon as it has been parsed
+    with open(output_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        for header_line, page_num, page_end, body_lines in read_entries(input_file):
             # Extract the name (text after ##)
-            name = line[2:].strip()
+            name = header_line[2:].strip()
+            firstlast = to_firstlast(name)
             
-            # Apply replacement if available
+            # Apply replacement if available, matching either the name or its "firstlast" version
             if name in replacements:
                 name = replacements[name]
-            else:
-                # Also check if the "firstlast" version matches any replacement key
-                name_parts = name.split(',')
-                if len(name_parts) >= 2:
-                    firstlast_name = f"{name_parts[1].strip()} {name_parts[0].strip()}"
-                    if firstlast_name in replacements:
-                        name = replacements[firstlast_name]
-            
-            # Look for the page number in HTML comments before this header
-            page_num = None
-            j = i - 1
-            while j >= 0:
-                comment_match = re.search(r'<!-- Page (\d+):', lines[j])
-                if comment_match:
-                    page_num = int(comment_match.group(1))
-                    break
-                j -= 1
+                firstlast = to_firstlast(name)
+            elif firstlast in replacements:
+                name = replacements[firstlast]
+                firstlast = to_firstlast(name)
             
-            # Collect aka content (lines after the header until empty line or next header)
+            # Walk the entry once, over the lines between this header and the next:
+            # - aka: the lines right after the header, until the first empty line
+            # - dob: the first non-empty line after the aka block, if it starts with a date
+            # - row count and char count over all lines of the entry
             aka_lines = []
-            i += 1
-            
-            # Check if the next line is empty - if so, this entry has no content
-            if i < len(lines) and lines[i].strip() == '':
-                # Header followed immediately by empty line - no content
-                pass
-            else:
-                # Skip any empty lines immediately after header
-                while i < len(lines) and lines[i].strip() == '':
-                    i += 1
-                
-                # Collect content until we hit an empty line or next header
-                while i < len(lines):
-                    current_line = lines[i].strip()
-                    
-                    # Stop if we hit an empty line
-                    if current_line == '':
-                        break
-                    
-                    # Stop if we hit another header
-                    if current_line.startswith('##'):
-                        i -= 1  # Back up one line so the next iteration can process this header
-                        break
-                    
-                    # Add this line to aka content
-                    aka_lines.append(current_line)
-                    i += 1
-            
-            # Join aka lines with semicolons and clean up
-            aka = '; '.join(aka_lines).strip()
-
-            # Check if first non-empty line after header and aka starts with a date (dd.mm.yyyy format)
+            in_aka = True
             dob = None
-            j = i
-            while j < len(lines):
-                current_line = lines[j].strip()
-                if current_line != '':
-                    # Check if this first non-empty line starts with a date
-                    date_match = re.match(r'^(\d{1,2}\.\d{1,2}\.\d{4})', current_line)
-                    if date_match:
-                        dob = date_match.group(1)   
-                    break  # Only check the first non-empty line
-                j += 1
-            
-            # Now collect all content for counting (from header to next header)
-            # Reset to line after header
-            count_i = i - len(aka_lines) if aka_lines else i
-            if count_i < len(lines) and lines[count_i].strip() == '':
-                count_i += 1  # Skip empty line after header
-            
-            # Count all non-empty lines until next header and calculate total chars
+            dob_checked = False
             count = 0
             total_chars = 0
-            page_end = page_num if page_num else None  # Initialize with page_start
-            while count_i < len(lines):
-                current_line = lines[count_i].strip()
+            for current_line in body_lines:
+                if current_line == '':
+                    # An empty line ends the aka content
+                    in_aka = False
+                    continue
                 
-                # Stop if we hit another header
-                if current_line.startswith('##'):
-                    break
-                
-                # Check for page comments and update page_end
-                comment_match = re.search(r'<!-- Page (\d+):', current_line)
-                if comment_match:
-                    page_end = int(comment_match.group(1))
+                if in_aka:
+                    aka_lines.append(current_line)
+                elif not dob_checked:
+                    # Check if this first non-empty line after the aka starts with a date (dd.mm.yyyy format)
+                    date_match = DOB_RE.match(current_line)
+                    if date_match:
+                        dob = date_match.group(1)
+                    dob_checked = True
                 
                 # Count non-empty lines and their characters
-                if current_line != '':
-                    count += 1
-                    total_chars += len(current_line)
-                
-                count_i += 1
+                count += 1
+                total_chars += len(current_line)
+            
+            # Join aka lines with semicolons, they are already stripped by read_entries
+            aka = '; '.join(aka_lines)
             
             # Check if aka starts with "ks."
             ks_value = 1 if aka.lower().startswith('ks.') else 0
             
-            # Create firstlast by splitting name by comma and reversing
-            name_parts = name.split(',')
-            if len(name_parts) >= 2:
-                firstlast = f"{name_parts[1].strip()} {name_parts[0].strip()}"
-            else:
-                firstlast = name  # If no comma, keep original name
+            # Add to CSV data, the header row is written together with the first entry
+            row = (
+                name,
+                aka,
+                page_num if page_num else '',
+                page_end if page_end else '',
+                count,
+                total_chars,
+                ks_value,
+                firstlast,
+                dob if dob else ''
+            )
+            if first_entry is None:
+                writer.writerow(CSV_FIELDNAMES)
+                first_entry = row
+            writer.writerow(row)
             
-            # Add to CSV data
-            csv_data.append({
-                'name': name,
-                'aka': aka,
-                'page_start': page_num if page_num else '',
-                'page_end': page_end if page_end else '',
-                'row_count': count,
-                'chars_count': total_chars,
-                'ks.': ks_value,
-                'firstlast': firstlast,
-                'dob': dob if dob else ''
-            })
-        
-        i += 1
-    
-    # Write CSV file
-    with open(output_file, 'w', newline='', encoding='utf-8') as f:
-        if csv_data:
-            writer = csv.DictWriter(f, fieldnames=['name', 'aka', 'page_start', 'page_end', 'row_count', 'chars_count', 'ks.', 'firstlast', 'dob'])
-            writer.writeheader()
-            writer.writerows(csv_data)
+            entry_count += 1
+            # Count rows without ks. value 1
+            if ks_value != 1:
+                rows_without_ks += 1
     
     print(f"CSV file created: {output_file}")
-    print(f"Total entries: {len(csv_data)}")
-    
-    # Count rows without ks. value 1
-    rows_without_ks = sum(1 for entry in csv_data if entry['ks.'] != 1)
+    print(f"Total entries: {entry_count}")
     print(f"Rows without ks. value 1: {rows_without_ks}")
     
     # Print first entry as preview
-    if csv_data:
+    if first_entry is not None:
         print("\nFirst entry:")
-        entry = csv_data[0]
+        entry = dict(zip(CSV_FIELDNAMES, first_entry))
         print(f"Name: '{entry['name']}'")
         print(f"AKA: '{entry['aka']}'")
         print(f"Page start: {entry['page_start']}")
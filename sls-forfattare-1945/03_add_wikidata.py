@@ -10,8 +10,380 @@ import time
 import sys
 import json
 import argparse
+import asyncio
+import threading
+import os
+import sqlite3
+import gzip
+import bz2
+import unicodedata
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
 import re
 from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Use orjson to parse the query results if it is installed, it is faster than json
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Maximum number of Wikidata searches running at the same time (the --workers default).
+# The query service allows at most 5 parallel queries per client.
+MAX_CONCURRENT_SEARCHES = 5
+# Requests per second sent to the Wikidata query service by all searches together
+REQUESTS_PER_SECOND = 5
+# Times a query is retried after a 429 (too many requests) response
+MAX_RATE_LIMIT_RETRIES = 5
+# Number of names looked up with one query in search_wikidata_batch()
+BATCH_SIZE = 50
+# Results kept per searched name, the birth year is matched against these
+MAX_RESULTS_PER_NAME = 10
+
+# Query pattern for ?personLabel, the label in the first of fi, sv, en, mul that the person has.
+# Same choice as the wikibase:label service makes, without the service's extra lookup per query.
+# The label service falls back to the Q-code when there is no label, that is done in Python.
+PERSON_LABEL_PATTERN = """
+  OPTIONAL { ?person rdfs:label ?labelFi . FILTER(LANG(?labelFi) = "fi") }
+  OPTIONAL { ?person rdfs:label ?labelSv . FILTER(LANG(?labelSv) = "sv") }
+  OPTIONAL { ?person rdfs:label ?labelEn . FILTER(LANG(?labelEn) = "en") }
+  OPTIONAL { ?person rdfs:label ?labelMul . FILTER(LANG(?labelMul) = "mul") }
+  BIND(COALESCE(?labelFi, ?labelSv, ?labelEn, ?labelMul) AS ?personLabel)"""
+# Languages of ?personLabel in PERSON_LABEL_PATTERN, in the same order
+PERSON_LABEL_LANGUAGES = ('fi', 'sv', 'en', 'mul')
+
+# Languages of the searched names, labels and aliases in fi, sv, en and mul
+NAME_LANGUAGES = ('fi', 'sv', 'en', 'mul')
+
+# Name search query. Only the VALUES block with the searched names changes between
+# queries, the rest of the query is always the same.
+NAME_QUERY = Template("""
+SELECT ?name ?person ?personLabel ?birthDate WHERE {
+  VALUES ?name { $names }
+  {
+    ?person rdfs:label ?name .
+  } UNION {
+    ?person skos:altLabel ?name .
+  }
+  ?person wdt:P31 wd:Q5 .  # Instance of human
+  OPTIONAL { ?person wdt:P569 ?birthDate . }""" + PERSON_LABEL_PATTERN + """
+}
+""")
+
+# Characters that must be escaped in a SPARQL string literal
+SPARQL_STRING_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '"': '\\"',
+    '\n': '\\n',
+    '\r': '\\r',
+    '\t': '\\t',
+    '\b': '\\b',
+    '\f': '\\f'
+})
+
+# 4-digit year anywhere in a date of birth, e.g. 7.10.1930
+DOB_YEAR_RE = re.compile(r'\b(\d{4})\b')
+# Year at the start of a Wikidata date, e.g. 1930-10-07T00:00:00Z
+WIKIDATA_YEAR_RE = re.compile(r'(\d{4})')
+# "v:een YYYY" (vuoteen, until the year) in aka values
+AKA_YEAR_RE = re.compile(r'v:een\s+\d{4}\s*')
+
+
+def create_session():
+    """
+    Create the HTTP session used for all queries. It keeps the connections to the
+    query service open between requests, one per concurrent search, and retries
+    requests that fail with a server error, with exponential backoff. SPARQL queries
+    don't change anything, so POST requests are retried too.
+    Rate limit responses (429) are handled by run_sparql_query() instead, so that
+    all searches pause together.
+    """
+    session = requests.Session()
+    retries = Retry(total=5, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504], allowed_methods=['GET', 'POST'])
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_SEARCHES, max_retries=retries)
+    session.mount('https://', adapter)
+    return session
+
+
+SESSION = create_session()
+
+# Rate limit state shared by all searches: the send times of the requests in the
+# last second, and the time until which the server asked us to stop sending
+_rate_limit = {'sent': deque(), 'paused_until': 0.0, 'backoff': 1.0}
+_rate_limit_lock = threading.Lock()
+
+
+def wait_for_rate_limit():
+    """
+    Wait until a request may be sent: when fewer than REQUESTS_PER_SECOND requests
+    were sent during the last second and no pause from a 429 response is in effect.
+    """
+    while True:
+        with _rate_limit_lock:
+            now = time.monotonic()
+            sent = _rate_limit['sent']
+            while sent and sent[0] <= now - 1.0:
+                sent.popleft()
+            
+            delay = _rate_limit['paused_until'] - now
+            if len(sent) >= REQUESTS_PER_SECOND:
+                delay = max(delay, sent[0] + 1.0 - now)
+            if delay <= 0:
+                sent.append(now)
+                return
+        
+        time.sleep(delay)
+
+
+def pause_for_rate_limit(retry_after):
+    """
+    Pause all requests after a 429 response, for as long as the Retry-After header asks
+    but at least for the current backoff, which doubles with every 429 in a row.
+    
+    Args:
+        retry_after (str): Value of the Retry-After header, seconds (None if missing)
+    """
+    with _rate_limit_lock:
+        delay = _rate_limit['backoff']
+        try:
+            delay = max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            pass
+        _rate_limit['backoff'] = min(_rate_limit['backoff'] * 2, 60.0)
+        _rate_limit['paused_until'] = max(_rate_limit['paused_until'], time.monotonic() + delay)
+    print(f"Rate limited by Wikidata, pausing requests for {delay:.0f} s...")
+
+
+def reset_rate_limit_backoff():
+    """Reset the 429 backoff after a request went through"""
+    with _rate_limit_lock:
+        _rate_limit['backoff'] = 1.0
+
+
+# Search results are cached per name on disk, shared by the scripts of both books,
+# so that re-runs (e.g. with --start-row) don't query the same names again.
+# Names without results are cached too, as an empty list.
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'wikidata_cache.sqlite')
+CACHE_MAX_AGE = 30 * 24 * 60 * 60  # 30 days in seconds
+# Cache key prefix for the kind of name search this script does (labels and aliases in fi, sv, en and mul),
+# so results of different searches for the same name are kept apart
+CACHE_KEY_PREFIX = 'label-alias-fi-sv-en-mul:'
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _get_cache_db():
+    """Open the cache database on first use, must be called with _cache_lock held"""
+    if 'db' not in _cache:
+        db = sqlite3.connect(CACHE_FILE, timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute("CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, fetched REAL, bindings TEXT)")
+        _cache['db'] = db
+    return _cache['db']
+
+
+def cache_get(name):
+    """
+    Get cached search results for a name.
+    
+    Args:
+        name (str): The searched name
+    
+    Returns:
+        list: Cached result bindings, or None if the name is not cached or the entry has expired
+    """
+    with _cache_lock:
+        row = _get_cache_db().execute(
+            "SELECT bindings FROM search_cache WHERE key = ? AND fetched > ?",
+            (CACHE_KEY_PREFIX + name, time.time() - CACHE_MAX_AGE)
+        ).fetchone()
+    return json_loads(row[0]) if row else None
+
+
+def cache_put(results):
+    """
+    Store search results in the cache.
+    
+    Args:
+        results (dict): Searched name mapped to its result bindings
+    """
+    fetched = time.time()
+    with _cache_lock:
+        db = _get_cache_db()
+        with db:
+            db.execute("BEGIN")
+            db.executemany(
+                "INSERT OR REPLACE INTO search_cache (key, fetched, bindings) VALUES (?, ?, ?)",
+                [(CACHE_KEY_PREFIX + name, fetched, json.dumps(bindings)) for name, bindings in results.items()]
+            )
+
+
+# Names can be looked up in a local label index instead of querying Wikidata, see load_label_index()
+WIKIDATA_ENTITY_URI = 'http://www.wikidata.org/entity/'
+
+_label_index = {}
+
+
+def load_label_index(index_file):
+    """
+    Load a local label index, so that names are looked up in it instead of querying Wikidata.
+    The index is a tab separated file with a header line and the columns label, lang, qcode,
+    person_label and birth_date (as in query results, e.g. 1850-05-01T00:00:00Z), one line
+    per label or alias of a human. It is built from a Wikidata dump once with
+    build_label_index(), after which the searches need no network. Lines in languages this script doesn't search are skipped.
+    
+    Args:
+        index_file (str): Path to the index file
+    
+    Returns:
+        int: Number of distinct labels loaded
+    """
+    labels = {}
+    with open(index_file, 'r', encoding='utf-8', newline='') as file:
+        reader = csv.reader(file, delimiter='\t', quoting=csv.QUOTE_NONE)
+        label_index, lang_index, qcode_index, person_label_index, birth_date_index = find_columns(
+            next(reader, []), ('label', 'lang', 'qcode', 'person_label', 'birth_date')
+        )
+        for row in reader:
+            if get_column(row, lang_index) not in NAME_LANGUAGES:
+                continue
+            
+            # Same form as the bindings of query_name_bindings()
+            binding = {'person': {'value': WIKIDATA_ENTITY_URI + get_column(row, qcode_index)}}
+            person_label = get_column(row, person_label_index)
+            if person_label:
+                binding['personLabel'] = {'value': person_label}
+            birth_date = get_column(row, birth_date_index)
+            if birth_date:
+                binding['birthDate'] = {'value': birth_date}
+            labels.setdefault(normalize_name(get_column(row, label_index)), []).append(binding)
+    
+    _label_index['labels'] = labels
+    return len(labels)
+
+
+# Date of birth parts the dump gives as 00 when the month or day is unknown, the query gives 01
+UNKNOWN_DATE_PART_RE = re.compile(r'-00(?=[-T])')
+
+
+def best_rank_values(entity, property_id):
+    """
+    Values of a property of an entity in a Wikidata dump, the same values as wdt: gives
+    in queries: those of the preferred statements if there are any, otherwise those of
+    the normal ones.
+    """
+    statements = [statement for statement in entity.get('claims', {}).get(property_id, [])
+                  if statement.get('rank') != 'deprecated']
+    preferred = [statement for statement in statements if statement.get('rank') == 'preferred']
+    return [statement['mainsnak']['datavalue']['value'] for statement in preferred or statements
+            if 'datavalue' in statement.get('mainsnak', {})]
+
+
+def build_label_index(dump_file, index_file):
+    """
+    Build a label index for load_label_index() from a Wikidata JSON dump, e.g.
+    latest-all.json.gz from https://dumps.wikimedia.org/wikidatawiki/entities/.
+    Writes the labels and aliases in NAME_LANGUAGES of all humans (P31 Q5), with the person
+    label chosen as in PERSON_LABEL_PATTERN and one line per date of birth (P569), as the
+    name search query gives them. Reading a full dump takes several hours.
+    
+    Args:
+        dump_file (str): Path to the dump, compressed with gzip (.gz) or bzip2 (.bz2) or not at all
+        index_file (str): Path to the index file to write
+    
+    Returns:
+        int: Number of lines written
+    """
+    if dump_file.endswith('.gz'):
+        dump = gzip.open(dump_file, 'rt', encoding='utf-8')
+    elif dump_file.endswith('.bz2'):
+        dump = bz2.open(dump_file, 'rt', encoding='utf-8')
+    else:
+        dump = open(dump_file, 'r', encoding='utf-8')
+    
+    line_count = 0
+    with dump, open(index_file, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file, delimiter='\t', quoting=csv.QUOTE_NONE, quotechar=None, lineterminator='\n')
+        writer.writerow(['label', 'lang', 'qcode', 'person_label', 'birth_date'])
+        for entity_count, line in enumerate(dump, 1):
+            if entity_count % 1000000 == 0:
+                print(f"Read {entity_count} entities, wrote {line_count} lines")
+            
+            # The dump is a JSON array with one entity per line, only lines that can be humans are parsed
+            line = line.rstrip().rstrip(',')
+            if not line.startswith('{') or '"Q5"' not in line:
+                continue
+            entity = json_loads(line)
+            if not any(value.get('id') == 'Q5' for value in best_rank_values(entity, 'P31') if isinstance(value, dict)):
+                continue
+            
+            labels = entity.get('labels', {})
+            person_label = next((labels[lang]['value'] for lang in PERSON_LABEL_LANGUAGES if lang in labels), '')
+            birth_dates = [UNKNOWN_DATE_PART_RE.sub('-01', value['time'].lstrip('+'))
+                           for value in best_rank_values(entity, 'P569') if isinstance(value, dict) and 'time' in value]
+            
+            names = [(lang, label['value']) for lang, label in labels.items()]
+            names += [(lang, alias['value']) for lang, aliases in entity.get('aliases', {}).items() for alias in aliases]
+            for lang, name in dict.fromkeys(names):
+                # Tabs and line breaks can't be written to the index, such labels are not searched for anyway
+                if lang not in NAME_LANGUAGES or any(char in name + person_label for char in '\t\r\n'):
+                    continue
+                for birth_date in birth_dates or ['']:
+                    writer.writerow([name, lang, entity['id'], person_label, birth_date])
+                    line_count += 1
+    
+    return line_count
+
+
+def index_name_bindings(names):
+    """Look names up in the label index, returns the same as query_name_bindings()"""
+    labels = _label_index['labels']
+    return {name: labels.get(name, [])[:MAX_RESULTS_PER_NAME] for name in names}
+
+
+def run_sparql_query(query, timeout=10):
+    """
+    Run a SPARQL query against the Wikidata query service.
+    
+    Args:
+        query (str): SPARQL query
+        timeout (int): Request timeout in seconds
+    
+    Returns:
+        list: Result bindings
+    """
+    # Wikidata SPARQL endpoint
+    url = "https://query.wikidata.org/sparql"
+    
+    headers = {
+        'User-Agent': 'Wikidata-Searcher/1.0 (projektfredrika.fi)',
+        'Accept': 'application/sparql-results+json',
+        'Accept-Encoding': 'gzip'
+    }
+    
+    # Send the query as a form POST, the batch queries are too long for a URL
+    data = {
+        'query': query,
+        'format': 'json'
+    }
+    
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        wait_for_rate_limit()
+        response = SESSION.post(url, data=data, headers=headers, timeout=timeout)
+        if response.status_code != 429:
+            break
+        if attempt < MAX_RATE_LIMIT_RETRIES:
+            pause_for_rate_limit(response.headers.get('Retry-After'))
+    response.raise_for_status()
+    reset_rate_limit_backoff()
+    
+    # Extract results (requests decompresses the gzipped response)
+    return json_loads(response.content).get('results', {}).get('bindings', [])
+
 
 def extract_year_from_dob(dob_str):
     """
@@ -28,7 +400,7 @@ def extract_year_from_dob(dob_str):
         return None
     
     # Look for 4-digit year at the end of the string
-    year_match = re.search(r'\b(\d{4})\b', dob_str)
+    year_match = DOB_YEAR_RE.search(dob_str)
     if year_match:
         return year_match.group(1)
     
@@ -49,178 +421,437 @@ def extract_year_from_wikidata_date(wd_date):
         return None
     
     # Extract year from ISO date format (YYYY-MM-DD...)
-    year_match = re.match(r'(\d{4})', wd_date)
+    year_match = WIKIDATA_YEAR_RE.match(wd_date)
     if year_match:
         return year_match.group(1)
     
     return None
 
 
-def search_wikidata_by_name(name, aka=None, dob=None):
+def qcode_from_uri(uri):
+    """Q-code from the end of a Wikidata entity URI, e.g. Q42 from http://www.wikidata.org/entity/Q42"""
+    return uri[uri.rfind('/') + 1:]
+
+
+def normalize_name(name):
     """
-    Search Wikidata for a person by name and return Q-code, Finnish label, and birth date.
-    If initial search fails and name has more than two words, tries again with each first name combined with last name.
-    If still no match and aka is provided, searches each aka value using the same strategy.
-    If dob is provided, prioritizes results where the birth year matches.
+    Write a name in one canonical form: Unicode NFC (composed characters like å and ä)
+    and single spaces between words. Labels are matched exactly, so a decomposed character
+    or an extra space would make the search miss, and the same name would be searched and
+    cached under several spellings.
     
     Args:
-        name (str): The name to search for
-        aka (str, optional): Alternative names separated by semicolons
-        dob (str, optional): Date of birth to match against (e.g., "7.10.1930")
+        name (str): The name
     
     Returns:
-        dict: {'qcode': str, 'wd_fi': str, 'wd_dob': str} or None if not found
+        str: The normalized name
     """
-    target_year = extract_year_from_dob(dob) if dob else None
-    
-    def perform_search(search_name):
-        """Helper function to perform the actual Wikidata search"""
-        try:
-            # Wikidata SPARQL query to search for people by name
-            # Search both primary labels (rdfs:label) and aliases (skos:altLabel)
-            # Search in multiple languages: fi, sv, en (Finnish, Swedish, English)
-            # Get multiple results so we can filter by birth year if dob is provided
-            # Escape any quotes in the search name for SPARQL
-            escaped_name = search_name.replace('"', '\\"')
-            
-            query = f"""
-            SELECT ?person ?personLabel ?birthDate WHERE {{
-              ?person wdt:P31 wd:Q5 .  # Instance of human
-              {{
-                ?person rdfs:label "{escaped_name}"@fi .
-              }} UNION {{
-                ?person rdfs:label "{escaped_name}"@sv .
-              }} UNION {{
-                ?person rdfs:label "{escaped_name}"@en .
-              }} UNION {{
-                ?person rdfs:label "{escaped_name}"@mul .
-              }} UNION {{
-                ?person skos:altLabel "{escaped_name}"@fi .
-              }} UNION {{
-                ?person skos:altLabel "{escaped_name}"@sv .
-              }} UNION {{
-                ?person skos:altLabel "{escaped_name}"@en .
-              }} UNION {{
-                ?person skos:altLabel "{escaped_name}"@mul .
-              }}
-              OPTIONAL {{ ?person wdt:P569 ?birthDate . }}
-              SERVICE wikibase:label {{ bd:serviceParam wikibase:language "fi,sv,en,mul" . }}
-            }}
-            LIMIT 10
-            """
-            
-            # Wikidata SPARQL endpoint
-            url = "https://query.wikidata.org/sparql"
-            
-            headers = {
-                'User-Agent': 'Wikidata-Searcher/1.0 (projektfredrika.fi)',
-                'Accept': 'application/sparql-results+json'
-            }
-            
-            params = {
-                'query': query,
-                'format': 'json'
-            }
-            
-            response = requests.get(url, params=params, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # Extract results
-            bindings = data.get('results', {}).get('bindings', [])
-            
-            if not bindings:
-                return None
-            
-            # If target_year is provided, prioritize results with matching birth year
-            if target_year:
-                # First, try to find exact year match
-                for binding in bindings:
-                    birth_date = binding.get('birthDate', {}).get('value', '')
-                    wd_year = extract_year_from_wikidata_date(birth_date)
-                    
-                    if wd_year == target_year:
-                        qcode = binding.get('person', {}).get('value', '').split('/')[-1]
-                        finnish_label = binding.get('personLabel', {}).get('value', '')
-                        
-                        print(f"    Found match with matching birth year {target_year}")
-                        return {
-                            'qcode': qcode,
-                            'wd_fi': finnish_label,
-                            'wd_dob': birth_date
-                        }
-                
-                # If no exact match, return None to try other search strategies
-                print(f"    Found {len(bindings)} results but none match birth year {target_year}, trying other strategies...")
-                return None
-            
-            # If no target_year, return first result
-            binding = bindings[0]
-            qcode = binding.get('person', {}).get('value', '').split('/')[-1]
-            finnish_label = binding.get('personLabel', {}).get('value', '')
-            birth_date = binding.get('birthDate', {}).get('value', '')
-            
-            return {
-                'qcode': qcode,
-                'wd_fi': finnish_label,
-                'wd_dob': birth_date
-            }
-            
-        except Exception as e:
-            print(f"Error searching Wikidata for '{search_name}': {str(e)}")
-            return None
+    return " ".join(unicodedata.normalize('NFC', name).split())
+
+
+def fallback_names(name, aka=None):
+    """
+    Names to search for when a name gives no match, in the order they are tried.
+    If the name has more than one word, each first name combined with the last name.
+    Then each aka value and its first names combined with its last name.
     
-    # First attempt with the full name
-    result = perform_search(name)
-    if result:
-        return result
+    Args:
+        name (str): The searched name
+        aka (str, optional): Alternative names separated by semicolons
     
+    Returns:
+        list: Fallback names, without name itself
+    """
+    search_names = []
     name_words = name.strip().split()
     
     # Fallback: if name has more than one word, try each name part combined with the last name
     if len(name_words) > 1:
         last_name = name_words[-1]
-        # Try each word (except the last one) combined with the last name
         for word in name_words[:-1]:
-            fallback_name = f"{word} {last_name}"
-            print(f"  No result for '{name}', trying fallback search with '{fallback_name}'...")
-            result = perform_search(fallback_name)
-            if result:
-                return result
+            search_names.append(f"{word} {last_name}")
     
-    # If still no match and aka is provided, try searching each aka value
+    # If still no match and aka is provided, try each aka value
     if aka:
         # Split aka by semicolon and clean each value
         aka_values = [a.strip() for a in aka.split(';') if a.strip()]
         
         for aka_value in aka_values:
             # Remove patterns like "v:een YYYY" where YYYY is a 4-digit year
-            cleaned_aka = re.sub(r'v:een\s+\d{4}\s*', '', aka_value).strip()
+            cleaned_aka = normalize_name(AKA_YEAR_RE.sub('', aka_value))
             if not cleaned_aka:
                 continue
             
-            print(f"  No result for '{name}', trying aka value '{cleaned_aka}'...")
-            
             # Try full aka name
-            result = perform_search(cleaned_aka)
-            if result:
-                return result
+            search_names.append(cleaned_aka)
             
             # Try each first name combined with last name for aka
-            aka_words = cleaned_aka.strip().split()
+            aka_words = cleaned_aka.split()
             if len(aka_words) > 1:
                 aka_last_name = aka_words[-1]
                 for word in aka_words[:-1]:
-                    fallback_aka = f"{word} {aka_last_name}"
-                    print(f"    Trying fallback search with '{fallback_aka}'...")
-                    result = perform_search(fallback_aka)
-                    if result:
-                        return result
+                    search_names.append(f"{word} {aka_last_name}")
+    
+    return [search_name for search_name in dict.fromkeys(search_names) if search_name != name]
+
+
+def search_wikidata_by_name(name, aka=None, dob=None, prefetched=None):
+    """
+    Search Wikidata for a person by name and return Q-code, Finnish label, and birth date.
+    If the name gives no match, tries the names from fallback_names() (name parts and aka values),
+    and the first of them (in this order) that matches is used.
+    If dob is provided, prioritizes results where the birth year matches.
+    
+    Args:
+        name (str): The name to search for
+        aka (str, optional): Alternative names separated by semicolons
+        dob (str, optional): Date of birth to match against (e.g., "7.10.1930")
+        prefetched (dict, optional): Bindings by name from search_wikidata_batch(), names
+                                     missing from it are searched here with one query
+    
+    Returns:
+        dict: {'qcode': str, 'wd_fi': str, 'wd_dob': str} or None if not found
+    """
+    target_year = extract_year_from_dob(dob) if dob else None
+    
+    def pick_result(bindings):
+        """Helper function to pick the result from the bindings of one searched name"""
+        if not bindings:
+            return None
+        
+        # If target_year is provided, prioritize results with matching birth year
+        if target_year:
+            # First, try to find exact year match
+            for binding in bindings:
+                birth_date = binding.get('birthDate', {}).get('value', '')
+                wd_year = extract_year_from_wikidata_date(birth_date)
+                
+                if wd_year == target_year:
+                    qcode = qcode_from_uri(binding.get('person', {}).get('value', ''))
+                    finnish_label = binding.get('personLabel', {}).get('value', '') or qcode
+                    
+                    print(f"    Found match with matching birth year {target_year}")
+                    return {
+                        'qcode': qcode,
+                        'wd_fi': finnish_label,
+                        'wd_dob': birth_date
+                    }
+            
+            # If no exact match, return None to try other search strategies
+            print(f"    Found {len(bindings)} results but none match birth year {target_year}, trying other strategies...")
+            return None
+        
+        # If no target_year, return first result
+        binding = bindings[0]
+        qcode = qcode_from_uri(binding.get('person', {}).get('value', ''))
+        finnish_label = binding.get('personLabel', {}).get('value', '') or qcode
+        birth_date = binding.get('birthDate', {}).get('value', '')
+        
+        return {
+            'qcode': qcode,
+            'wd_fi': finnish_label,
+            'wd_dob': birth_date
+        }
+    
+    # The full name first, then the fallback names
+    search_names = [name] + fallback_names(name, aka)
+    prefetched = prefetched or {}
+    fetched = {}
+    
+    for position, search_name in enumerate(search_names):
+        if search_name not in prefetched and search_name not in fetched:
+            # Names missing from the prefetched results (e.g. when their batch failed)
+            # are searched here, all the remaining ones with one query
+            try:
+                fetched = fetch_name_bindings([n for n in search_names[position:] if n not in prefetched])
+            except Exception as e:
+                print(f"Error searching Wikidata for '{name}': {str(e)}")
+                return None
+        
+        result = pick_result(prefetched.get(search_name, fetched.get(search_name)))
+        if result:
+            if search_name != name:
+                print(f"  Matched fallback search '{search_name}'")
+            return result
+        
+        if search_name == name and len(search_names) > 1:
+            print(f"  No result for '{name}', trying fallback search with {', '.join(repr(n) for n in search_names[1:])}...")
     
     return None
 
 
+def sparql_literal(text, lang):
+    """
+    Write text as a SPARQL string literal with a language tag, e.g. "Aho"@fi.
+    Backslashes, quotes and line breaks are escaped, so any name gives a valid query.
+    
+    Args:
+        text (str): The text
+        lang (str): Language code
+    
+    Returns:
+        str: The literal
+    """
+    return f'"{text.translate(SPARQL_STRING_ESCAPES)}"@{lang}'
+
+
+def query_name_bindings(names, timeout=60):
+    """
+    Search Wikidata for several names with one SPARQL query, and cache the results.
+    Each name is matched as a label or alias in fi, sv, en or mul of a human.
+    
+    Args:
+        names (list): Names to search for
+        timeout (int): Request timeout in seconds
+    
+    Returns:
+        dict: Name mapped to its result bindings (empty list if there were no results),
+              keeping the first 10 results per name
+    """
+    values = " ".join(sparql_literal(name, lang) for name in names for lang in NAME_LANGUAGES)
+    query = NAME_QUERY.substitute(names=values)
+    
+    results = {name: [] for name in names}
+    for binding in run_sparql_query(query, timeout=timeout):
+        name_bindings = results.get(binding.get('name', {}).get('value', ''))
+        if name_bindings is not None and len(name_bindings) < MAX_RESULTS_PER_NAME:
+            name_bindings.append(binding)
+    cache_put(results)
+    
+    return results
+
+
+def fetch_name_bindings(names):
+    """
+    Get the search results for names, from the cache or else with one query for the rest.
+    
+    Args:
+        names (list): Names to search for
+    
+    Returns:
+        dict: Name mapped to its result bindings, see query_name_bindings()
+    """
+    # With a label index nothing needs to be queried
+    if 'labels' in _label_index:
+        return index_name_bindings(names)
+    
+    results = {}
+    uncached_names = []
+    for name in names:
+        bindings = cache_get(name)
+        if bindings is None:
+            uncached_names.append(name)
+        else:
+            results[name] = bindings
+    
+    if uncached_names:
+        results.update(query_name_bindings(uncached_names))
+    
+    return results
+
+
+def search_wikidata_batch(names, batch_size=BATCH_SIZE):
+    """
+    Search Wikidata for many names at once, with one SPARQL query per batch of names.
+    Only names that are not in the cache are queried.
+    Names whose batch failed are left out, search_wikidata_by_name then searches them itself.
+    
+    Args:
+        names (list): Names to search for
+        batch_size (int): Number of names per query
+    
+    Returns:
+        dict: Name mapped to its result bindings, see query_name_bindings()
+    """
+    if 'labels' in _label_index:
+        print(f"Looking up {len(names)} names in the label index")
+        return index_name_bindings(names)
+    
+    results = {}
+    
+    # Names with cached results don't need to be queried
+    uncached_names = []
+    for name in names:
+        bindings = cache_get(name)
+        if bindings is None:
+            uncached_names.append(name)
+        else:
+            results[name] = bindings
+    if results:
+        print(f"Found cached results for {len(results)} names")
+    names = uncached_names
+    
+    batch_count = (len(names) + batch_size - 1) // batch_size
+    for batch_start in range(0, len(names), batch_size):
+        batch = names[batch_start:batch_start + batch_size]
+        print(f"Batch {batch_start // batch_size + 1}/{batch_count}: Searching Wikidata for {len(batch)} names...")
+        
+        try:
+            results.update(query_name_bindings(batch))
+        except Exception as e:
+            print(f"Error in batch search, searching these names row by row instead: {str(e)}")
+    
+    return results
+
+
+def get_column(row, index):
+    """Value of a CSV row in the column at index, empty if the column is missing (index None) or the row is short"""
+    return row[index] if index is not None and index < len(row) else ''
+
+
+def find_columns(header, columns):
+    """Positions of columns in a CSV header, None for columns that are not in it"""
+    return [header.index(column) if column in header else None for column in columns]
+
+
+def load_done_results(output_file):
+    """
+    Load the Wikidata results of an earlier run from the output file, so those rows don't
+    have to be searched again. Only rows with a Q-code are used, rows without a match are
+    searched again.
+    
+    Args:
+        output_file (str): Path to the output CSV file of an earlier run
+    
+    Returns:
+        dict: (firstlast, aka, dob) mapped to {'qcode': str, 'wd_fi': str, 'wd_dob': str},
+              empty if the file doesn't exist
+    """
+    done_results = {}
+    try:
+        with open(output_file, 'r', encoding='utf-8') as file:
+            reader = csv.reader(file)
+            firstlast_index, aka_index, dob_index, wd_index, wd_fi_index, wd_dob_index = find_columns(
+                next(reader, []), ('firstlast', 'aka', 'dob', 'wd', 'wd_fi', 'wd_dob')
+            )
+            for row in reader:
+                qcode = get_column(row, wd_index)
+                if qcode:
+                    # Same key as the searches in search_rows(), rows with another aka are searched separately
+                    key = (normalize_name(get_column(row, firstlast_index)), get_column(row, aka_index), get_column(row, dob_index))
+                    done_results[key] = {
+                        'qcode': qcode,
+                        'wd_fi': get_column(row, wd_fi_index),
+                        'wd_dob': get_column(row, wd_dob_index)
+                    }
+    except FileNotFoundError:
+        pass
+    
+    return done_results
+
+
+async def search_rows(eligible_rows, workers=MAX_CONCURRENT_SEARCHES, done_results=None):
+    """
+    Search Wikidata for all eligible rows concurrently.
+    The names and fallback names of all rows are searched in batches up front with
+    search_wikidata_batch(), the row searches then pick their results from these.
+    Rows that are in done_results are not searched again.
+    Rows with the same name, aka and dob share one search.
+    The searches run in a pool of worker threads, as requests is blocking but releases
+    the GIL while it waits for the network. wait_for_rate_limit() keeps the overall
+    request rate within budget.
+    
+    Args:
+        eligible_rows (list): (original_index, row, name, aka, dob) tuples
+        workers (int): Number of searches running at the same time
+        done_results (dict, optional): Results from an earlier run, see load_done_results()
+    
+    Yields:
+        tuple: (original_index, row, name, result) in the same order as eligible_rows,
+               where result is the search result (dict or None)
+    """
+    loop = asyncio.get_running_loop()
+    
+    def search_row(eligible_index, original_index, name, aka, dob):
+        print(f"Row {original_index+1} (eligible #{eligible_index+1}): Searching Wikidata for '{name}'...")
+        
+        # Search Wikidata (pass aka and dob columns if available)
+        return search_wikidata_by_name(name, aka if aka else None, dob if dob else None, prefetched)
+    
+    print(f"Searching with {workers} worker threads")
+    
+    # Results from an earlier run are handed out as they are
+    done_results = done_results or {}
+    row_done_results = [done_results.get((name, aka, dob)) for _, _, name, aka, dob in eligible_rows]
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # All names the rows can be searched with, so that the searches of the rows are
+        # lookups in these results and need no queries of their own
+        names = list(dict.fromkeys(
+            search_name
+            for (_, _, name, aka, _), done_result in zip(eligible_rows, row_done_results)
+            if done_result is None
+            for search_name in [name] + fallback_names(name, aka)
+        ))
+        prefetched = await loop.run_in_executor(executor, search_wikidata_batch, names)
+        
+        # Start one search per distinct key, duplicate rows wait for the same search
+        searches = {}
+        row_searches = []
+        for eligible_index, ((original_index, row, name, aka, dob), done_result) in enumerate(zip(eligible_rows, row_done_results)):
+            if done_result is not None:
+                row_searches.append(None)
+                continue
+            key = (name, aka, dob)
+            if key not in searches:
+                searches[key] = loop.run_in_executor(executor, search_row, eligible_index, original_index, name, aka, dob)
+            row_searches.append(searches[key])
+        
+        searched_count = len(row_searches) - row_searches.count(None)
+        if len(searches) < searched_count:
+            print(f"Searching {len(searches)} distinct names for {searched_count} rows")
+        
+        # Hand out the results in row order as soon as each one is done
+        for (original_index, row, name, aka, dob), search, done_result in zip(eligible_rows, row_searches, row_done_results):
+            yield original_index, row, name, (done_result if search is None else await search)
+
+
+async def write_results(eligible_rows, workers, output_file, fieldnames, done_results):
+    """
+    Search Wikidata for the eligible rows and write each row with its Wikidata
+    columns to the output CSV file as soon as its result is in. The file is
+    flushed after every row, so an interrupted run keeps the rows done so far.
+    
+    Args:
+        eligible_rows (list): (original_index, row, name, aka, dob) tuples
+        workers (int): Number of searches running at the same time
+        output_file (str): Path to the output CSV file
+        fieldnames (list): Output columns
+        done_results (dict): Results from an earlier run, see load_done_results()
+    
+    Returns:
+        int: Number of rows written
+    """
+    processed_count = 0
+    
+    # Positions of the Wikidata columns in the output rows
+    wd_indexes = find_columns(fieldnames, ('wd', 'wd_fi', 'wd_dob'))
+    
+    with open(output_file, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(fieldnames)
+        
+        async for original_index, row, name, result in search_rows(eligible_rows, workers, done_results):
+            print(f"Row {original_index+1}: '{name}'")
+            if result:
+                print(f"  Found: {result['qcode']} - {result['wd_fi']}")
+                wd_values = (result['qcode'], result['wd_fi'], result['wd_dob'])
+            else:
+                print(f"  No Wikidata entry found")
+                wd_values = ('', '', '')
+            
+            # The input values, padded to the output columns, with the Wikidata columns filled in
+            output_row = row + [''] * (len(fieldnames) - len(row))
+            for index, value in zip(wd_indexes, wd_values):
+                output_row[index] = value
+            
+            writer.writerow(output_row)
+            file.flush()
+            processed_count += 1
+    
+    return processed_count
+
+
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Add Wikidata information to CSV file')
@@ -230,21 +861,56 @@ def main():
                        help='Input CSV file (default: 02_output.csv)')
     parser.add_argument('--output', default='03_output.csv',
                        help='Output CSV file (default: 03_output.csv)')
+    parser.add_argument('--workers', type=int, default=MAX_CONCURRENT_SEARCHES,
+                       help=f'Number of searches running at the same time (1-{MAX_CONCURRENT_SEARCHES}, default: {MAX_CONCURRENT_SEARCHES})')
+    parser.add_argument('--label-index',
+                       help='Local label index file to look names up in instead of querying Wikidata')
+    parser.add_argument('--build-label-index', metavar='DUMP',
+                       help='Build the --label-index file from a Wikidata JSON dump and exit')
     
     args = parser.parse_args()
     
     input_file = args.input
     output_file = args.output
     start_row = args.start_row
+    workers = args.workers
+    
+    if workers < 1 or workers > MAX_CONCURRENT_SEARCHES:
+        print(f"Error: workers must be between 1 and {MAX_CONCURRENT_SEARCHES}")
+        sys.exit(1)
+    
+    # Build the label index from a dump instead of processing the CSV file
+    if args.build_label_index:
+        if not args.label_index:
+            print("Error: give the index file to write with --label-index")
+            sys.exit(1)
+        try:
+            line_count = build_label_index(args.build_label_index, args.label_index)
+        except (OSError, EOFError, ValueError) as e:
+            print(f"Error building {args.label_index} from {args.build_label_index}: {e}")
+            sys.exit(1)
+        print(f"Wrote {line_count} lines to {args.label_index}")
+        return
+    
+    # Names are looked up in the label index instead of Wikidata if one is given
+    if args.label_index:
+        try:
+            label_count = load_label_index(args.label_index)
+        except OSError as e:
+            print(f"Error reading {args.label_index}: {e}")
+            sys.exit(1)
+        print(f"Loaded {label_count} labels from {args.label_index}, names are not searched on Wikidata")
     
     print(f"Loading data from {input_file}...")
     print(f"Starting from row {start_row}")
     
-    # Read the CSV file
+    # Read the CSV file, rows are kept as lists of values and only the
+    # columns the script needs are looked up by their position
     try:
         with open(input_file, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            rows = list(reader)
+            reader = csv.reader(file)
+            input_fieldnames = next(reader, [])
+            rows = [row for row in reader if row]
     except FileNotFoundError:
         print(f"Error: {input_file} not found")
         sys.exit(1)
@@ -264,25 +930,28 @@ def main():
     print(f"Starting from row {start_row} of {len(rows)} total rows")
     print(f"Processing {len(rows_to_process)} rows")
     
+    # Positions of the columns used for filtering and searching
+    firstlast_index, aka_index, dob_index, ks_index = find_columns(input_fieldnames, ('firstlast', 'aka', 'dob', 'ks.'))
+    
     # First pass: filter out rows with ks. = 1
     eligible_rows = []
     skipped_count = 0
     
     for i, row in enumerate(rows_to_process):
         original_index = start_row - 1 + i  # Original position in full CSV
-        ks_value = row.get('ks.', '')
+        ks_value = get_column(row, ks_index)
         
         # Skip rows where ks. = 1
         if ks_value == '1':
-            print(f"Row {original_index+1}: Skipping '{row.get('firstlast', '')}' (ks. = 1)")
+            print(f"Row {original_index+1}: Skipping '{get_column(row, firstlast_index)}' (ks. = 1)")
             skipped_count += 1
             continue
         
-        name = row.get('firstlast', '')
+        name = normalize_name(get_column(row, firstlast_index))
         if not name:
             continue
             
-        eligible_rows.append((original_index, row))  # Store original row index and row data
+        eligible_rows.append((original_index, row, name, get_column(row, aka_index), get_column(row, dob_index)))  # Store original row index, row data and search fields
     
     print(f"Found {len(eligible_rows)} eligible rows after filtering out ks. = 1")
     
@@ -290,56 +959,25 @@ def main():
         print("No eligible rows to process")
         sys.exit(0)
     
-    # Second pass: process eligible rows
-    filtered_rows = []
-    processed_count = 0
+    # Second pass: search the eligible rows and write them to the output file
+    # Output columns are the input columns followed by the new Wikidata columns
+    fieldnames = input_fieldnames + [column for column in ('wd', 'wd_fi', 'wd_dob') if column not in input_fieldnames]
     
-    for eligible_index, (original_index, row) in enumerate(eligible_rows):
-        name = row.get('firstlast', '')
-        aka = row.get('aka', '')
-        dob = row.get('dob', '')
-        print(f"Row {original_index+1} (eligible #{eligible_index+1}): Searching Wikidata for '{name}'...")
-        
-        # Search Wikidata (pass aka and dob columns if available)
-        result = search_wikidata_by_name(name, aka if aka else None, dob if dob else None)
-        
-        if result:
-            print(f"  Found: {result['qcode']} - {result['wd_fi']}")
-            row['wd'] = result['qcode']
-            row['wd_fi'] = result['wd_fi']
-            row['wd_dob'] = result['wd_dob']
-        else:
-            print(f"  No Wikidata entry found")
-            row['wd'] = ''
-            row['wd_fi'] = ''
-            row['wd_dob'] = ''
-        
-        filtered_rows.append(row)
-        processed_count += 1
-        
-        # Be nice to the API - add a small delay
-        time.sleep(0.5)
+    # Rows that already got a Q-code in an earlier run are not searched again
+    done_results = load_done_results(output_file)
+    if done_results:
+        print(f"Found {len(done_results)} rows with Wikidata results in {output_file}, these are not searched again")
+    
+    try:
+        processed_count = asyncio.run(write_results(eligible_rows, workers, output_file, fieldnames, done_results))
+    except OSError as e:
+        print(f"Error writing {output_file}: {e}")
+        sys.exit(1)
     
     print(f"\nProcessed {processed_count} rows from row {start_row} onwards")
     print(f"Skipped {skipped_count} rows with ks. = 1")
-    
-    # Write the filtered CSV with new columns
-    if filtered_rows:
-        # Get fieldnames from the first row and add new columns
-        fieldnames = list(filtered_rows[0].keys())
-        
-        try:
-            with open(output_file, 'w', encoding='utf-8', newline='') as file:
-                writer = csv.DictWriter(file, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(filtered_rows)
-            
-            print(f"Results saved to {output_file}")
-            print(f"Total rows in output: {len(filtered_rows)}")
-            
-        except Exception as e:
-            print(f"Error writing {output_file}: {e}")
-            sys.exit(1)
+    print(f"Results saved to {output_file}")
+    print(f"Total rows in output: {processed_count}")
 
 
 if __name__ == "__main__":
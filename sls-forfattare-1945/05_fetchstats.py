@@ -6,34 +6,232 @@ Outputs results to an Excel file.
 """
 
 import requests
-import time
 import json
+import asyncio
+import argparse
+import threading
+import os
+import sqlite3
+import time
+import hashlib
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 from urllib.parse import quote
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment
 from openpyxl.utils import get_column_letter
+from openpyxl.cell import WriteOnlyCell
+
+# Use orjson to parse the API responses if it is installed, it is faster than json
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Number of API requests running at the same time
+MAX_CONCURRENT_REQUESTS = 10
+# Number of titles the Action API accepts in one query
+MAX_TITLES_PER_QUERY = 50
+# Maximum number of requests sent per second, the Wikimedia REST API allows 100
+REQUESTS_PER_SECOND = 100
+# Wikipedia languages to fetch article lengths and pageviews for
+LANGUAGES = ('sv', 'fi', 'en')
+
+
+class JitterRetry(Retry):
+    """
+    Retry policy with full jitter: the wait before a retry is a random time up to the
+    exponential backoff, so that concurrent requests that failed together don't all
+    retry at the same moment. A Retry-After header from the server still takes precedence.
+    """
+    
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+
+def create_session():
+    """
+    Create the HTTP session used for all requests. It keeps the connections to the
+    API hosts (query.wikidata.org, wikimedia.org and the three Wikipedias) open
+    between requests, one per concurrent request, and retries requests that fail
+    with a rate limit or server error, with jittered exponential backoff. The SPARQL query
+    doesn't change anything, so its POST request is retried too.
+    """
+    session = requests.Session()
+    session.headers.update({
+        'User-Agent': 'SLS-Forfattare-1917/1.0 (projektfredrika.fi)',
+        'Accept': 'application/json'
+    })
+    retries = JitterRetry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET', 'POST'],
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(pool_connections=5, pool_maxsize=MAX_CONCURRENT_REQUESTS, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+SESSION = create_session()
+
+# Send times of the requests in the last second, shared by all fetches
+_rate_limit = {'sent': deque()}
+_rate_limit_lock = threading.Lock()
+
+
+def wait_for_rate_limit():
+    """
+    Wait until a request may be sent: when fewer than REQUESTS_PER_SECOND requests
+    were sent during the last second.
+    """
+    while True:
+        with _rate_limit_lock:
+            now = time.monotonic()
+            sent = _rate_limit['sent']
+            while sent and sent[0] <= now - 1.0:
+                sent.popleft()
+            
+            if len(sent) < REQUESTS_PER_SECOND:
+                sent.append(now)
+                return
+            delay = sent[0] + 1.0 - now
+        
+        time.sleep(delay)
+
+
+# API responses are cached on disk for a day, so that re-runs don't fetch the same
+# data again. Missing pages (404) are cached too, so they are not asked for again.
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'wikipedia_cache.sqlite')
+CACHE_MAX_AGE = 24 * 60 * 60  # 1 day in seconds
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _get_cache_db():
+    """Open the cache database on first use, must be called with _cache_lock held"""
+    if 'db' not in _cache:
+        db = sqlite3.connect(CACHE_FILE, timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute("CREATE TABLE IF NOT EXISTS http_cache (key TEXT PRIMARY KEY, fetched REAL, status INTEGER, body TEXT)")
+        _cache['db'] = db
+    return _cache['db']
+
+
+def clear_cache():
+    """Remove all cached responses"""
+    with _cache_lock:
+        _get_cache_db().execute("DELETE FROM http_cache")
+
+
+def cache_get(key):
+    """
+    Get a cached response.
+    
+    Args:
+        key (str): Cache key
+    
+    Returns:
+        tuple: (status, body) of the response, or None if it is not cached or has expired
+    """
+    with _cache_lock:
+        return _get_cache_db().execute(
+            "SELECT status, body FROM http_cache WHERE key = ? AND fetched > ?",
+            (key, time.time() - CACHE_MAX_AGE)
+        ).fetchone()
+
+
+def cache_put(key, status, body):
+    """Store a response in the cache"""
+    with _cache_lock:
+        _get_cache_db().execute(
+            "INSERT OR REPLACE INTO http_cache (key, fetched, status, body) VALUES (?, ?, ?, ?)",
+            (key, time.time(), status, body)
+        )
+
+
+def get_json(url, params=None, headers=None, timeout=10):
+    """
+    GET a JSON API response, from the cache if it was fetched within CACHE_MAX_AGE.
+    
+    Args:
+        url (str): API URL
+        params (dict, optional): Query parameters
+        headers (dict, optional): Headers in addition to the session headers
+        timeout (int): Request timeout in seconds
+    
+    Returns:
+        dict: The response JSON, or None if the page was not found (404)
+    
+    Raises:
+        requests.HTTPError: If the request failed with another error status
+    """
+    # The full URL with the encoded query parameters is the cache key
+    key = requests.Request('GET', url, params=params).prepare().url
+    
+    cached = cache_get(key)
+    if cached:
+        status, body = cached
+    else:
+        wait_for_rate_limit()
+        response = SESSION.get(url, params=params, headers=headers, timeout=timeout)
+        if response.status_code != 404:
+            response.raise_for_status()
+        status, body = response.status_code, response.text
+        cache_put(key, status, body)
+    
+    return None if status == 404 else json_loads(body)
 
 
-def run_sparql_query(query):
-    """Execute SPARQL query and return results"""
+def run_sparql_query(query, refresh=False):
+    """
+    Execute SPARQL query and return results.
+    The results are cached like the API responses, keyed by a hash of the query.
+    
+    Args:
+        query (str): SPARQL query
+        refresh (bool): Run the query even if its results are cached
+    
+    Returns:
+        list: Result bindings
+    """
     url = "https://query.wikidata.org/sparql"
+    key = 'sparql:' + hashlib.sha1(query.encode('utf-8')).hexdigest()
+    
+    cached = None if refresh else cache_get(key)
+    if cached:
+        print("Using cached SPARQL query results")
+        bindings = json_loads(cached[1]).get('results', {}).get('bindings', [])
+        print(f"Found {len(bindings)} results")
+        return bindings
     
     headers = {
-        'User-Agent': 'SLS-Forfattare-1917/1.0 (projektfredrika.fi)',
         'Accept': 'application/sparql-results+json'
     }
     
-    params = {
+    # Send the query as a form POST, it is too long for a URL
+    form = {
         'query': query,
         'format': 'json'
     }
     
+    # The whole response is read before any pageviews are fetched. The query is sorted
+    # (ORDER BY), so the service only sends the first result once all results are found,
+    # and reading the response as a stream would not let the fetches start noticeably earlier
     print("Running SPARQL query...")
-    response = requests.get(url, params=params, headers=headers, timeout=30)
+    wait_for_rate_limit()
+    response = SESSION.post(url, data=form, headers=headers, timeout=30)
     response.raise_for_status()
+    cache_put(key, response.status_code, response.text)
     
-    data = response.json()
+    data = json_loads(response.content)
     bindings = data.get('results', {}).get('bindings', [])
     
     print(f"Found {len(bindings)} results")
@@ -51,7 +249,10 @@ def get_wikipedia_pageviews(page_title, language, start_date, end_date):
         end_date (str): End date in YYYYMMDD format
     
     Returns:
-        int: Total pageviews for the period
+        int: Total pageviews for the period, 0 if the page doesn't exist
+    
+    Raises:
+        requests.RequestException: If the pageviews could not be fetched, also after retries
     """
     if not page_title:
         return 0
@@ -62,54 +263,48 @@ def get_wikipedia_pageviews(page_title, language, start_date, end_date):
     project = f"{language}.wikipedia"
     access = "all-access"
     agent = "all-agents"
-    article = page_title.replace(" ", "_")
+    article = wiki_url_path(page_title)
     granularity = "monthly"  # or daily
     
     url = f"https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article/{project}/{access}/{agent}/{article}/{granularity}/{start_date}/{end_date}"
     
-    try:
-        headers = {
-            'User-Agent': 'SLS-Forfattare-1917/1.0 (projektfredrika.fi)',
-            'Accept': 'application/json'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        
-        if response.status_code == 404:
-            # Page doesn't exist
-            return 0
-        
-        response.raise_for_status()
-        data = response.json()
-        
-        # Sum up all pageviews
-        total_views = 0
-        items = data.get('items', [])
-        for item in items:
-            total_views += item.get('views', 0)
-        
-        return total_views
+    data = get_json(url, timeout=10)
     
-    except Exception as e:
-        print(f"  Error fetching pageviews for '{page_title}' in {language}: {str(e)}")
+    if data is None:
+        # Page doesn't exist
         return 0
+    
+    # Sum up all pageviews
+    total_views = 0
+    items = data.get('items', [])
+    for item in items:
+        total_views += item.get('views', 0)
+    
+    return total_views
 
 
-def get_wikipedia_article_length(page_title, language):
+def get_wikipedia_article_info(page_titles, language):
     """
-    Fetch Wikipedia article length (number of bytes) for a given page title.
+    Fetch the Wikipedia article (after redirects) and its length (number of bytes)
+    for up to MAX_TITLES_PER_QUERY page titles with one request.
     Uses the Action API with prop=info which returns a reliable `length` field
-    and handles redirects.
+    and handles redirects. The API answers with the normalized or redirect target
+    title, these are mapped back to the given titles.
 
     Args:
-        page_title (str): Wikipedia page title
+        page_titles (list): Wikipedia page titles
         language (str): Language code (sv, fi, en)
 
     Returns:
-        int: Page length in bytes, 0 if not available
+        dict: Page title mapped to (article title, page length in bytes),
+              the length is 0 if not available
+
+    Raises:
+        requests.RequestException: If the info could not be fetched, also after retries
     """
-    if not page_title:
-        return 0
+    info = {page_title: (page_title, 0) for page_title in page_titles}
+    if not page_titles:
+        return info
 
     url = f"https://{language}.wikipedia.org/w/api.php"
     params = {
@@ -117,39 +312,199 @@ def get_wikipedia_article_length(page_title, language):
         'format': 'json',
         'formatversion': '2',
         'prop': 'info',
-        'titles': page_title,
+        'titles': '|'.join(page_titles),
         'redirects': '1',
     }
 
+    data = get_json(url, params=params, timeout=10) or {}
+    query = data.get('query', {})
+    normalized = {item['from']: item['to'] for item in query.get('normalized', [])}
+    redirects = {item['from']: item['to'] for item in query.get('redirects', [])}
+    page_lengths = {
+        page.get('title'): int(page.get('length', 0) or 0)
+        for page in query.get('pages', [])
+        if not page.get('missing')
+    }
+    for page_title in page_titles:
+        title = normalized.get(page_title, page_title)
+        title = redirects.get(title, title)
+        info[page_title] = (title, page_lengths.get(title, 0))
+
+    return info
+
+
+async def fetch_all_stats(unique_rows, start_date, end_date, languages=LANGUAGES):
+    """
+    Fetch article lengths and pageviews for all rows concurrently.
+    The articles and their lengths are fetched for up to MAX_TITLES_PER_QUERY titles
+    of a language at once. Pageviews are then fetched once per distinct article,
+    for the article a title redirects to.
+    The fetches run in a pool of worker threads, as requests is blocking but releases
+    the GIL while it waits for the network. The pool size limits how many requests
+    run at the same time.
+    
+    Args:
+        unique_rows (list): Rows from the SPARQL query
+        start_date (str): Start date in YYYYMMDD format
+        end_date (str): End date in YYYYMMDD format
+        languages (tuple): Wikipedia languages to fetch, the columns of other languages are left empty
+    
+    Returns:
+        list: The rows with length and pageview columns added, in the same order
+    """
+    loop = asyncio.get_running_loop()
+    
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        # Start the article info fetches, in batches of the distinct titles per language
+        info_fetches = {}
+        for language in languages:
+            titles = list(dict.fromkeys(clean_title(row.get(f'wp_{language}_title', '')) for row in unique_rows))
+            titles = [title for title in titles if title]
+            for batch_start in range(0, len(titles), MAX_TITLES_PER_QUERY):
+                batch = titles[batch_start:batch_start + MAX_TITLES_PER_QUERY]
+                info_fetch = loop.run_in_executor(executor, get_wikipedia_article_info, batch, language)
+                for title in batch:
+                    info_fetches[(language, title)] = info_fetch
+        
+        # Pageviews are fetched for the article a title redirects to, as the pageviews API
+        # doesn't follow redirects. Titles of the same article share one fetch
+        article_views_fetches = {}
+        
+        async def fetch_views(language, title):
+            try:
+                article_title = (await info_fetches[(language, title)])[title][0]
+            except Exception:
+                # Without the article info, the views are fetched for the title itself
+                article_title = title
+            if (language, article_title) not in article_views_fetches:
+                article_views_fetches[(language, article_title)] = loop.run_in_executor(
+                    executor, get_wikipedia_pageviews, article_title, language, start_date, end_date
+                )
+            return await article_views_fetches[(language, article_title)]
+        
+        # Start the pageview fetches of all rows, for each language the row has a Wikipedia title in.
+        # Rows with the same title share one fetch
+        views_fetches = {}
+        row_fetches = []
+        for row in unique_rows:
+            fetches = {}
+            for language in languages:
+                title = clean_title(row.get(f'wp_{language}_title', ''))
+                if title:
+                    if (language, title) not in views_fetches:
+                        views_fetches[(language, title)] = loop.create_task(fetch_views(language, title))
+                    fetches[language] = (title, views_fetches[(language, title)], info_fetches[(language, title)])
+            row_fetches.append(fetches)
+        
+        # Collect the results in row order
+        total = len(unique_rows)
+        rows = []
+        for idx, (row, fetches) in enumerate(zip(unique_rows, row_fetches), 1):
+            print(f"\n[{idx}/{total}] Processing: {row.get('itemLabel_sv', row.get('itemLabel_en', 'Unknown'))}")
+            
+            # Wait for the fetches of all languages of the row together, failed fetches give their exception
+            results = dict(zip(fetches, await asyncio.gather(*(
+                asyncio.gather(views_fetch, info_fetch, return_exceptions=True)
+                for _, views_fetch, info_fetch in fetches.values()
+            ))))
+            
+            for language in languages:
+                views = 0
+                length = 0
+                if language in fetches:
+                    title = fetches[language][0]
+                    views, batch_info = results[language]
+                    print(f"  Fetching pageviews for {language}.wikipedia.org/wiki/{title}")
+                    
+                    # A failed fetch leaves the cell empty, so that it is not mistaken for a page without views
+                    if isinstance(views, Exception):
+                        print(f"  Error fetching pageviews for '{title}' in {language}: {str(views)}")
+                        views = ''
+                    else:
+                        print(f"    Total views: {views:,}")
+                    
+                    if isinstance(batch_info, Exception):
+                        print(f"  Error fetching length for '{title}' in {language}: {str(batch_info)}")
+                        length = ''
+                    else:
+                        length = batch_info[title][1]
+                        print(f"    Length (chars): {length:,}")
+                
+                # Add article length and pageview count to row
+                row[f'length_{language}'] = length
+                row[f'views_{language}'] = views
+            
+            rows.append(row)
+    
+    return rows
+
+
+def date_argument(value):
+    """
+    Check a date given on the command line.
+    
+    Args:
+        value (str): Date in YYYYMMDD format
+    
+    Returns:
+        str: The date
+    
+    Raises:
+        argparse.ArgumentTypeError: If the date is not in YYYYMMDD format
+    """
     try:
-        headers = {
-            'User-Agent': 'SLS-Forfattare-1917/1.0 (projektfredrika.fi)',
-            'Accept': 'application/json'
-        }
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        pages = data.get('query', {}).get('pages', [])
-        if not pages:
-            return 0
-        page = pages[0]
-        if page.get('missing'):
-            return 0
-        return int(page.get('length', 0) or 0)
-    except Exception as e:
-        print(f"  Error fetching length for '{page_title}' in {language}: {str(e)}")
-        return 0
+        datetime.strptime(value, "%Y%m%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{value}', use YYYYMMDD")
+    return value
+
+
+def languages_argument(value):
+    """
+    Parse a comma separated list of Wikipedia languages given on the command line.
+    
+    Args:
+        value (str): Languages, e.g. "sv,fi"
+    
+    Returns:
+        tuple: The languages, without duplicates
+    
+    Raises:
+        argparse.ArgumentTypeError: If a language is not one of LANGUAGES
+    """
+    languages = tuple(dict.fromkeys(language.strip() for language in value.split(',') if language.strip()))
+    for language in languages:
+        if language not in LANGUAGES:
+            raise argparse.ArgumentTypeError(f"unknown language '{language}', use {','.join(LANGUAGES)}")
+    if not languages:
+        raise argparse.ArgumentTypeError("no languages given")
+    return languages
 
 
-def get_date_range_one_year_back():
-    """Get start and end dates for the past 12 months"""
-    end_date = datetime.now()
+def get_date_range_one_year_back(end=None):
+    """Get start and end dates for the 12 months up to end (YYYYMMDD), by default up to today"""
+    end_date = datetime.strptime(end, "%Y%m%d") if end else datetime.now()
     start_date = end_date - timedelta(days=365)
     
     # Format as YYYYMMDD
     return start_date.strftime("%Y%m%d"), end_date.strftime("%Y%m%d")
 
 
+def wiki_url_path(title):
+    """
+    Convert a Wikipedia page title to the form used in URL paths.
+    Wikipedia uses underscores for spaces in URLs, other special characters are URL-encoded,
+    so that e.g. a '/' or '?' in the title stays part of it.
+    
+    Args:
+        title (str): Page title, e.g. "Johan Ludvig Runeberg"
+    
+    Returns:
+        str: The title for a URL path, e.g. "Johan_Ludvig_Runeberg"
+    """
+    return quote(title.replace(' ', '_'), safe='_')
+
+
 def clean_title(title):
     """Remove Wikipedia namespace prefixes if present"""
     if title:
@@ -175,23 +530,28 @@ def extract_qcode(item_url):
 
 
 def create_excel(rows, output_file):
-    """Create Excel file with SPARQL results and pageview statistics"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Author Statistics"
+    """
+    Create Excel file with SPARQL results and pageview statistics.
+    The workbook is written in write-only mode, which streams the rows to the
+    file instead of keeping a cell object for every value in memory.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Author Statistics")
+    
+    # Styles, created once and shared by all cells that use them
+    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    header_font = Font(bold=True, color="FFFFFF")
+    header_alignment = Alignment(horizontal="center", vertical="center")
+    link_font = Font(color="0000FF", underline="single")
     
     if not rows:
         wb.save(output_file)
         return
     
-    # Get headers from all rows to ensure all columns are included
-    # Collect all unique keys from all rows
-    all_keys = set()
-    for row_data in rows:
-        all_keys.update(row_data.keys())
-    
-    # Define column order as they appear in the SPARQL query SELECT statement
-    sparql_column_order = [
+    # Columns in the order they appear in the SPARQL query SELECT statement,
+    # followed by the article length and pageview columns.
+    # The query is fixed, so other keys don't occur in the rows
+    headers = [
         'item',
         'dob',
         'itemLabel_sv',
@@ -204,74 +564,72 @@ def create_excel(rows, output_file):
         'forfattare_ref',
         'wp_sv_title',
         'wp_fi_title',
-        'wp_en_title'
+        'wp_en_title',
+        'length_sv',
+        'length_fi',
+        'length_en',
+        'views_sv',
+        'views_fi',
+        'views_en'
     ]
     
-    # Excluded keys (commented-out fields)
-    excluded_keys = ['pobLabel', 'dod', 'podLabel']
-    
-    headers = []
-    
-    # Add columns in SPARQL query order, if they exist in the data
-    for col in sparql_column_order:
-        if col in all_keys and col not in excluded_keys:
-            headers.append(col)
-    
-    # Add any other columns that might exist but weren't in the expected order
-    # (shouldn't happen, but just in case)
-    for key in sorted(all_keys):
-        if key not in headers and key not in excluded_keys and key not in ['views_sv', 'views_fi', 'views_en', 'length_sv', 'length_fi', 'length_en']:
-            headers.append(key)
-    
-    # Add pageview columns at the end
-    headers.extend(['length_sv', 'length_fi', 'length_en', 'views_sv', 'views_fi', 'views_en'])
-    
-    # Write headers
-    for col_idx, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_idx, value=header)
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-    
-    # Write data
-    for row_idx, row_data in enumerate(rows, 2):
-        for col_idx, header in enumerate(headers, 1):
-            value = row_data.get(header, '')
-            cell = ws.cell(row=row_idx, column=col_idx, value=value)
-            
-            # If this is the 'item' column, make it a hyperlink to Wikidata
-            if header == 'item' and value:
-                qcode = extract_qcode(value)
-                if qcode:
-                    wiki_url = f"https://www.wikidata.org/wiki/{qcode}"
-                    cell.hyperlink = wiki_url
-                    cell.font = Font(color="0000FF", underline="single")
-                    # Store Q-code as display value
-                    cell.value = qcode
-            
-            # If this is a Wikipedia title column, make it a hyperlink to Wikipedia
-            elif header in ['wp_sv_title', 'wp_fi_title', 'wp_en_title'] and value:
-                # Extract language code from column name (wp_sv_title -> sv, etc.)
-                lang_code = header.replace('wp_', '').replace('_title', '')
-                # Create Wikipedia URL - Wikipedia uses underscores for spaces in URLs
-                # First replace spaces with underscores, then URL-encode any remaining special chars
-                title_url = value.replace(' ', '_')
-                # URL-encode the title (but keep underscores)
-                title_url_encoded = quote(title_url, safe='_')
-                wiki_url = f"https://{lang_code}.wikipedia.org/wiki/{title_url_encoded}"
-                cell.hyperlink = wiki_url
-                cell.font = Font(color="0000FF", underline="single")
-    
-    # Auto-adjust column widths
-    for col_idx, header in enumerate(headers, 1):
-        col_letter = get_column_letter(col_idx)
-        max_length = len(str(header))
-        for row_idx in range(2, len(rows) + 2):
-            value = ws.cell(row=row_idx, column=col_idx).value
+    # Column letters of the headers (A, B, ...)
+    col_letters = [get_column_letter(col_idx) for col_idx in range(1, len(headers) + 1)]
+    
+    # Header cells
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = header_alignment
+        header_cells.append(cell)
+    
+    # Columns whose values are made hyperlinks, with the URL the value is added to:
+    # the 'item' column to Wikidata, and the Wikipedia title columns to Wikipedia
+    link_columns = []
+    for col_idx, header in enumerate(headers):
+        if header == 'item':
+            link_columns.append((col_idx, "https://www.wikidata.org/wiki/"))
+        elif header in ['wp_sv_title', 'wp_fi_title', 'wp_en_title']:
+            # Extract language code from column name (wp_sv_title -> sv, etc.)
+            lang_code = header.replace('wp_', '').replace('_title', '')
+            link_columns.append((col_idx, f"https://{lang_code}.wikipedia.org/wiki/"))
+    item_col = headers.index('item')
+    
+    # Data values, with cells for the values that are hyperlinks.
+    # The widest value of each column is tracked on the way, for the column widths
+    widths = [len(str(header)) for header in headers]
+    data_rows = []
+    for row_data in rows:
+        row_values = [row_data.get(header, '') for header in headers]
+        
+        # Store Q-code as display value of the item
+        if row_values[item_col]:
+            row_values[item_col] = extract_qcode(row_values[item_col])
+        
+        for col_idx, value in enumerate(row_values):
             if value:
-                max_length = max(max_length, len(str(value)))
-        ws.column_dimensions[col_letter].width = min(max_length + 2, 50)
+                widths[col_idx] = max(widths[col_idx], len(str(value)))
+        
+        for col_idx, url_base in link_columns:
+            value = row_values[col_idx]
+            if value:
+                cell = WriteOnlyCell(ws, value=value)
+                cell.hyperlink = url_base + wiki_url_path(value)
+                cell.font = link_font
+                row_values[col_idx] = cell
+        
+        data_rows.append(row_values)
+    
+    # Auto-adjust column widths, in write-only mode they must be set before any row is written
+    for col_letter, width in zip(col_letters, widths):
+        ws.column_dimensions[col_letter].width = min(width + 2, 50)
+    
+    # Write the rows
+    ws.append(header_cells)
+    for row_values in data_rows:
+        ws.append(row_values)
     
     wb.save(output_file)
     print(f"Excel file saved to {output_file}")
@@ -290,11 +648,7 @@ WHERE {
   ?s ps:P1343 wd:Q136677319 . 
   ?s pq:P304 ?forfattare_sida.
   OPTIONAL{?s pq:P958 ?forfattare_ref.}
-  OPTIONAL { ?item wdt:P31 ?inst }
   OPTIONAL { ?item wdt:P569 ?dob }
-  OPTIONAL { ?item wdt:P570 ?dod }
-  OPTIONAL { ?item wdt:P19 ?pob }
-  OPTIONAL { ?item wdt:P20 ?pod }
   
   # Fetch item labels in specific languages
   OPTIONAL { ?item rdfs:label ?itemLabel_sv. FILTER(LANG(?itemLabel_sv) = "sv") }
@@ -315,115 +669,82 @@ WHERE {
   OPTIONAL { ?wp_en_url schema:about ?item . 
              ?wp_en_url schema:isPartOf <https://en.wikipedia.org/>; 
              schema:name ?wp_en_title. }
-SERVICE wikibase:label { bd:serviceParam wikibase:language "sv,fi,en". }
 } ORDER BY ?forfattare_ref
 # LIMIT 10
 """
 
 
 def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Fetch Wikipedia article lengths and pageviews for the authors')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Clear the cached API responses and fetch everything again')
+    parser.add_argument('--refresh-sparql', action='store_true',
+                       help='Run the SPARQL query again even if its results are cached')
+    parser.add_argument('--limit', type=int,
+                       help='Only fetch statistics for the first N authors')
+    parser.add_argument('--langs', type=languages_argument, default=LANGUAGES,
+                       help='Comma separated Wikipedia languages to fetch (default: sv,fi,en)')
+    parser.add_argument('--start', type=date_argument,
+                       help='Start date of the pageviews in YYYYMMDD format (default: 12 months ago)')
+    parser.add_argument('--end', type=date_argument,
+                       help='End date of the pageviews in YYYYMMDD format (default: today)')
+    
+    args = parser.parse_args()
+    
+    if args.limit is not None and args.limit < 1:
+        parser.error("--limit must be at least 1")
+    
     print("=" * 60)
     print("Wikipedia Pageview Statistics Fetcher")
     print("=" * 60)
     print()
     
-    # Get date range for the past year
-    start_date, end_date = get_date_range_one_year_back()
+    # Get date range for the past year, unless given on the command line.
+    # Without --start, the range starts 12 months before the end date
+    start_date, end_date = get_date_range_one_year_back(args.end)
+    start_date = args.start or start_date
+    if start_date > end_date:
+        parser.error(f"start date {start_date} is after end date {end_date}")
     print(f"Fetching pageviews from {start_date} to {end_date}")
-    print(f"Time period: Last 12 months")
+    if not (args.start or args.end):
+        print(f"Time period: Last 12 months")
+    if args.langs != LANGUAGES:
+        print(f"Languages: {', '.join(args.langs)}")
     print()
     
+    if args.no_cache:
+        print("Clearing cached API responses")
+        clear_cache()
+    
     # Run SPARQL query
-    bindings = run_sparql_query(sparql_query)
+    bindings = run_sparql_query(sparql_query, refresh=args.refresh_sparql)
     
     if not bindings:
         print("No results found from SPARQL query")
         return
     
-    # Process SPARQL results into rows
-    all_rows = []
-    for binding in bindings:
-        # Convert binding to a more usable format
-        row = {}
-        for key, value_obj in binding.items():
-            if isinstance(value_obj, dict) and 'value' in value_obj:
-                row[key] = value_obj['value']
-            else:
-                row[key] = ''
-        all_rows.append(row)
+    # Process SPARQL results into rows, each binding is {variable: {'type': ..., 'value': ...}}
+    all_rows = [{key: value_obj.get('value', '') for key, value_obj in binding.items()} for binding in bindings]
     
     # Remove duplicate rows based on forfattare_ref, keeping the first occurrence
-    seen_refs = set()
-    unique_rows = []
-    duplicates_removed = 0
-    
+    # If forfattare_ref is missing, treat it as empty string and still allow it
+    unique_by_ref = {}
     for row in all_rows:
-        forfattare_ref = row.get('forfattare_ref', '')
-        # If forfattare_ref is empty or None, treat it as empty string and still allow it
-        if forfattare_ref not in seen_refs:
-            seen_refs.add(forfattare_ref)
-            unique_rows.append(row)
-        else:
-            duplicates_removed += 1
+        unique_by_ref.setdefault(row.get('forfattare_ref', ''), row)
+    unique_rows = list(unique_by_ref.values())
+    duplicates_removed = len(all_rows) - len(unique_rows)
     
     if duplicates_removed > 0:
         print(f"Removed {duplicates_removed} duplicate row(s) based on 'forfattare_ref'")
         print(f"Keeping {len(unique_rows)} unique row(s) for pageview fetching\n")
     
+    if args.limit is not None and args.limit < len(unique_rows):
+        unique_rows = unique_rows[:args.limit]
+        print(f"Limiting to the first {args.limit} row(s)\n")
+    
     # Now fetch pageviews only for unique rows
-    total = len(unique_rows)
-    rows = []
-    
-    for idx, row in enumerate(unique_rows, 1):
-        # Get Wikipedia titles
-        wp_sv_title = clean_title(row.get('wp_sv_title', ''))
-        wp_fi_title = clean_title(row.get('wp_fi_title', ''))
-        wp_en_title = clean_title(row.get('wp_en_title', ''))
-        
-        print(f"\n[{idx}/{total}] Processing: {row.get('itemLabel_sv', row.get('itemLabel_en', 'Unknown'))}")
-        
-        # Fetch pageviews for each language
-        views_sv = 0
-        views_fi = 0
-        views_en = 0
-        # Fetch article length for each language
-        length_sv = 0
-        length_fi = 0
-        length_en = 0
-        
-        if wp_sv_title:
-            print(f"  Fetching pageviews for sv.wikipedia.org/wiki/{wp_sv_title}")
-            views_sv = get_wikipedia_pageviews(wp_sv_title, 'sv', start_date, end_date)
-            print(f"    Total views: {views_sv:,}")
-            length_sv = get_wikipedia_article_length(wp_sv_title, 'sv')
-            print(f"    Length (chars): {length_sv:,}")
-            time.sleep(0.2)  # Be nice to the API
-        
-        if wp_fi_title:
-            print(f"  Fetching pageviews for fi.wikipedia.org/wiki/{wp_fi_title}")
-            views_fi = get_wikipedia_pageviews(wp_fi_title, 'fi', start_date, end_date)
-            print(f"    Total views: {views_fi:,}")
-            length_fi = get_wikipedia_article_length(wp_fi_title, 'fi')
-            print(f"    Length (chars): {length_fi:,}")
-            time.sleep(0.2)
-        
-        if wp_en_title:
-            print(f"  Fetching pageviews for en.wikipedia.org/wiki/{wp_en_title}")
-            views_en = get_wikipedia_pageviews(wp_en_title, 'en', start_date, end_date)
-            print(f"    Total views: {views_en:,}")
-            length_en = get_wikipedia_article_length(wp_en_title, 'en')
-            print(f"    Length (chars): {length_en:,}")
-            time.sleep(0.2)
-        
-        # Add article lengths and pageview counts to row
-        row['length_sv'] = length_sv
-        row['length_fi'] = length_fi
-        row['length_en'] = length_en
-        row['views_sv'] = views_sv
-        row['views_fi'] = views_fi
-        row['views_en'] = views_en
-        
-        rows.append(row)
+    rows = asyncio.run(fetch_all_stats(unique_rows, start_date, end_date, args.langs))
     
     # Create Excel output
     output_file = '05_output.xlsx'